@@ -4,35 +4,587 @@ import sys
 if sys.version_info < (3, 4):
     raise "must use python 3.4 or greater"
 
+import array
+import contextlib
 import csv
-import statistics
+import io
 import argparse
-from collections import namedtuple
+from collections import deque, namedtuple
+from itertools import groupby
+import json
+from multiprocessing.pool import Pool
+import os
+import posixpath
+import warnings
 
-Measure = namedtuple("Measure", ["old", "new", "diff", "pct", "flag"])
+import numpy as np
+
+from diff_tracy_csv import sidecar
+from diff_tracy_csv.history import STATS as HISTORY_STATS, History
+from diff_tracy_csv.sketch import KllSketch
+from diff_tracy_csv.significance import (
+    DEFAULT_CONFIDENCE, DEFAULT_RESAMPLES, Distribution, interval,
+    is_significant, resample_means, resample_quantiles, resample_runs)
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pa_compute
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# `ci` is the confidence interval of `diff` when comparing several runs
+Measure = namedtuple("Measure", ["old", "new", "diff", "pct", "flag", "ci"],
+                     defaults=[None])
 Measures = namedtuple("Measures", ["median", "p90", "sum", "events"])
-Changes = namedtuple("Changes", ["zone", "measures"])
-
-
-def read_file(filename):
-    data = dict()
-    with open(filename, newline='', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        next(reader, None)  # skip header
-        rows = 0
-        for (name, src_file, src_line, _, exec_time_ns) in reader:
-            rows += 1
-            key = (name, src_file, src_line)
-            if key in data:
-                data[key].append(float(exec_time_ns))
+# `key` is the compared zone's key
+Changes = namedtuple("Changes", ["zone", "measures", "key"],
+                     defaults=[None])
+GateMeasures = namedtuple("GateMeasures",
+                          ["median", "p90", "p99", "sum", "events"])
+
+# Aggregate timings of a zone. Quantiles are None for zones with fewer than 3
+# events, which are never compared, and for groups of such zones, whose
+# quantiles are not compared. `rank_error` bounds the rank error of the
+# quantiles when they are estimated by a sketch, and is None when they are
+# exact. `distribution` holds the zone's times, or a sketch of them, for
+# testing the significance of changes, and is None when `median` is.
+ZoneStats = namedtuple("ZoneStats",
+                       ["events", "sum", "median", "p90", "p99",
+                        "rank_error", "distribution"])
+
+# Quantiles in ZoneStats, as (i, n) for the i-th of n quantiles
+QUANTILES = [(5, 10), (9, 10), (99, 100)]
+
+# Levels zones can be rolled up to, as functions from a zone's key to its
+# group's key
+ROLLUPS = {
+    "file": lambda key: key[1],
+    "dir": lambda key: posixpath.dirname(key[1]) + "/",
+    "name": lambda key: key[0],
+}
+
+# ZoneStats fields recorded in a history database, in the order of its STATS
+ZONE_HISTORY_FIELDS = ["events", "sum", "median", "p90", "p99"]
+
+# Columns of a `tracy-csvexport -u` export
+COLUMNS = ["name", "src_file", "src_line", "ns_since_start", "exec_time_ns"]
+
+# Size in bytes of each block of an export parsed at a time
+BLOCK_SIZE = 16 << 20
+
+# Default number of worker processes
+WORKERS = os.cpu_count() or 1
+
+# Exports to parse smaller than this in all are parsed without worker
+# processes, as starting them would take longer than parsing
+PARALLEL_PARSE_SIZE = 4 * BLOCK_SIZE
+
+# Confidence of the rank error bounds reported for sketches
+SKETCH_CONFIDENCE = 0.99
+
+# Seed for the sketches' random compactions, so output is reproducible
+SKETCH_SEED = 0
+
+# Seed for bootstrap resampling, combined with the index of each zone so that
+# every zone's resamples are reproducible on their own
+BOOTSTRAP_SEED = 0
+
+# Runs being compared, as passed to `init_compare`
+COMPARE_RUNS = None
+
+# Number of robust standard deviations a statistic of the latest build must
+# exceed its median over the window by for `gate` to flag it
+GATE_SPREADS = 3
+
+# Ratio of the standard deviation of normal data to its median absolute
+# deviation
+MAD_TO_STDDEV = 1.4826
+
+
+def csv_blocks(f, size):
+    """
+    Yield blocks of about `size` bytes read from `f`, each ending at a record
+    boundary. Blocks start at record boundaries, so a newline ends a record
+    only if an even number of quotes precede it in the block.
+    """
+    def quotes_before(data, end):
+        # Several times faster than bytes.count
+        return np.count_nonzero(
+            np.frombuffer(data, dtype=np.uint8, count=end) == ord('"'))
+
+    carry = b""
+    while True:
+        data = f.read(size)
+        if not data:
+            if carry:
+                yield carry
+            return
+        data = carry + data
+        end = data.rfind(b"\n")
+        while end != -1 and quotes_before(data, end) % 2 == 1:
+            end = data.rfind(b"\n", 0, end)
+        if end == -1:
+            # A record longer than the block size
+            carry = data
+            continue
+        yield data[:end + 1]
+        carry = data[end + 1:]
+
+
+def parse_block_arrow(block):
+    """
+    Parse a block of an export, without its header, with pyarrow. Returns a
+    list of zone keys and, for each event in the block, the index of its
+    zone's key and its execution time. Keys are listed in order of first
+    appearance.
+
+    Blocks are parsed one at a time rather than with `pyarrow.csv.open_csv`,
+    which reads ahead of its consumer without bound.
+    """
+    zone_type = pa.dictionary(pa.int32(), pa.string())
+    table = pa_csv.read_csv(
+        io.BytesIO(block),
+        read_options=pa_csv.ReadOptions(column_names=COLUMNS),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=["name", "src_file", "src_line", "exec_time_ns"],
+            column_types={"name": zone_type, "src_file": zone_type,
+                          "src_line": zone_type,
+                          "exec_time_ns": pa.float64()}))
+    table = table.unify_dictionaries().combine_chunks()
+
+    # Combine the dictionary indices of the key columns into one integer per
+    # event, then renumber them in order of first appearance
+    combined = np.zeros(table.num_rows, dtype=np.int64)
+    dictionaries = []
+    for column in ["name", "src_file", "src_line"]:
+        values = table.column(column).chunk(0)
+        dictionary = values.dictionary.to_pylist()
+        combined *= len(dictionary)
+        combined += values.indices.to_numpy(zero_copy_only=False)
+        dictionaries.append(dictionary)
+    unique = pa_compute.unique(combined)
+    zones = pa_compute.index_in(combined, value_set=unique).to_numpy()
+    keys = []
+    for code in unique.to_pylist():
+        code, line = divmod(code, len(dictionaries[2]))
+        name, src_file = divmod(code, len(dictionaries[1]))
+        keys.append((dictionaries[0][name], dictionaries[1][src_file],
+                     dictionaries[2][line]))
+    return keys, zones, table.column("exec_time_ns").to_numpy()
+
+
+def parse_block_csv(block):
+    """ Like `parse_block_arrow`, using the `csv` module. """
+    codes = dict()
+    zones = array.array("q")
+    times = array.array("d")
+    for (name, src_file, src_line, _, exec_time_ns) in csv.reader(
+            io.StringIO(block.decode("utf-8"), newline="")):
+        key = (name, src_file, src_line)
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(codes)
+        zones.append(code)
+        times.append(float(exec_time_ns))
+    return (list(codes), np.frombuffer(zones, dtype=np.int64),
+            np.frombuffer(times, dtype=np.float64))
+
+
+def parse_block(block):
+    return (parse_block_arrow if pa is not None else parse_block_csv)(block)
+
+
+def parse_range(block_range):
+    """ Read and parse the block (filename, start, end) of an export. """
+    filename, start, end = block_range
+    with open(filename, "rb") as f:
+        f.seek(start)
+        return parse_block(f.read(end - start))
+
+
+def read_blocks(filename):
+    """ Yield the blocks of an export after its header. """
+    with open(filename, "rb") as f:
+        f.readline()  # skip header
+        yield from csv_blocks(f, BLOCK_SIZE)
+
+
+def block_ranges(filename):
+    """
+    Yield the (filename, start, end) byte range of each block of an export,
+    as `read_blocks` splits it.
+    """
+    with open(filename, "rb") as f:
+        f.readline()  # skip header
+        start = f.tell()
+        for block in csv_blocks(f, BLOCK_SIZE):
+            yield filename, start, start + len(block)
+            start += len(block)
+
+
+def ordered_map(pool, func, items, window):
+    """
+    Like `pool.imap` over `(tag, arg)` pairs, yielding `(tag, func(arg))`
+    pairs in order, but with at most `window` items in flight, so that
+    results do not pile up while the caller is busy.
+    """
+    pending = deque()
+    for tag, arg in items:
+        pending.append((tag, pool.apply_async(func, (arg,))))
+        if len(pending) >= window:
+            tag, result = pending.popleft()
+            yield tag, result.get()
+    while pending:
+        tag, result = pending.popleft()
+        yield tag, result.get()
+
+
+def renumber(parsed_blocks, codes):
+    """
+    Yield the zone index and execution time of each event in parsed blocks,
+    in chunks. Zones are numbered in order of first appearance, and `codes`
+    is updated with the index of each zone's key as zones are read.
+    """
+    for keys, zones, times in parsed_blocks:
+        renumbered = np.array([codes.setdefault(key, len(codes))
+                               for key in keys], dtype=np.int64)
+        yield renumbered[zones], times
+
+
+def group_quantile(sorted_times, starts, counts, i, n=10):
+    """
+    Return `statistics.quantiles(times, n=n)[i - 1]` for each group of at
+    least two times, where the group starting at `starts[k]` in `sorted_times`
+    has `counts[k]` times in ascending order. This is the same integer
+    arithmetic and the same float operations as `statistics.quantiles`'
+    default "exclusive" method, so results are identical.
+    """
+    m = counts + 1
+    j = np.clip(i * m // n, 1, counts - 1)
+    delta = i * m - j * n
+    return ((sorted_times[starts + j - 1] * (n - delta) +
+             sorted_times[starts + j] * delta) / n)
+
+
+def zone_order(zones, num_zones):
+    """
+    Return the permutation that sorts `zones` stably. With the smallest
+    integer type that holds every zone index, numpy uses a radix sort.
+    """
+    zones = zones.astype(np.min_scalar_type(max(num_zones - 1, 0)))
+    return np.argsort(zones, kind="stable")
+
+
+def sort_by_zone(zones, times, num_zones):
+    """ Return `times` sorted stably by zone. """
+    return times[zone_order(zones, num_zones)]
+
+
+def exact_stats(chunks, num_zones):
+    """
+    Compute exact statistics of each zone from all events at once. Returns
+    the number of events and lists of ZoneStats fields, indexed by zone.
+    """
+    zones = np.concatenate([zones for (zones, _) in chunks] +
+                           [np.zeros(0, dtype=np.int64)])
+    times = np.concatenate([times for (_, times) in chunks] + [np.zeros(0)])
+
+    # Every statistic comes from one sort of the events by zone and time.
+    # Sums are accumulated in file order, like `sum` over each zone's times.
+    events = np.bincount(zones, minlength=num_zones)
+    sums = np.bincount(zones, weights=times, minlength=num_zones)
+    by_time = np.argsort(times)
+    sorted_times = sort_by_zone(zones[by_time], times[by_time], num_zones)
+    starts = np.cumsum(events) - events
+    quantiles = [[None] * num_zones for _ in QUANTILES]
+    distributions = [None] * num_zones
+    compared = np.flatnonzero(events > 2)
+    for (i, n), out in zip(QUANTILES, quantiles):
+        values = group_quantile(sorted_times, starts[compared],
+                                events[compared], i, n)
+        for zone, value in zip(compared.tolist(), values.tolist()):
+            out[zone] = value
+    for zone in compared.tolist():
+        distributions[zone] = Distribution(
+            sorted_times[starts[zone]:starts[zone] + events[zone]], None)
+    return (len(times), events.tolist(), sums.tolist(), *quantiles,
+            [None] * num_zones, distributions)
+
+
+def sketch_stats(chunks, codes, sketch_k):
+    """
+    Like `exact_stats`, but consumes one chunk at a time and estimates
+    quantiles with a KLL sketch of capacity `sketch_k` per zone, so memory
+    does not grow with the number of events.
+    """
+    rng = np.random.default_rng(SKETCH_SEED)
+    rows = 0
+    events = np.zeros(0, dtype=np.int64)
+    sums = np.zeros(0)
+    sketches = []
+    for zones, times in chunks:
+        rows += len(times)
+        num_zones = len(codes)
+        sketches.extend(KllSketch(sketch_k, rng)
+                        for _ in range(num_zones - len(sketches)))
+        chunk_events = np.bincount(zones, minlength=num_zones)
+        events = np.pad(events, (0, num_zones - len(events))) + chunk_events
+        sums = (np.pad(sums, (0, num_zones - len(sums))) +
+                np.bincount(zones, weights=times, minlength=num_zones))
+        sorted_times = sort_by_zone(zones, times, num_zones)
+        ends = np.cumsum(chunk_events)
+        for zone in np.flatnonzero(chunk_events).tolist():
+            sketches[zone].update(
+                sorted_times[ends[zone] - chunk_events[zone]:ends[zone]])
+
+    quantiles = [[] for _ in QUANTILES]
+    rank_errors = []
+    distributions = []
+    for sketch in sketches:
+        if sketch.n <= 2:
+            values = [None] * len(QUANTILES)
+            distribution = None
+        elif sketch.is_exact():
+            # The sketch still holds every time, so compute exact quantiles
+            times = np.sort(sketch.levels[0])
+            values = [group_quantile(times, np.array([0]),
+                                     np.array([sketch.n]), i, n)[0]
+                      for (i, n) in QUANTILES]
+            distribution = Distribution(times, None)
+        else:
+            values = [sketch.quantile(i / n) for (i, n) in QUANTILES]
+            times, weights = sketch.sorted_values_and_weights()
+            distribution = Distribution(times, np.cumsum(weights))
+        for out, value in zip(quantiles, values):
+            out.append(value)
+        rank_errors.append(sketch.rank_error(1 - SKETCH_CONFIDENCE))
+        distributions.append(distribution)
+    return (rows, events.tolist(), sums.tolist(), *quantiles, rank_errors,
+            distributions)
+
+
+def read_files(filenames, sketch_k=None, use_sidecar=True, workers=1):
+    """
+    Read exports and return, for each, the ZoneStats of each zone, keyed by
+    (name, src_file, src_line) in order of first appearance. With `sketch_k`,
+    quantiles are estimated by sketches of that capacity. With `use_sidecar`,
+    results are loaded from an export's sidecar if it is valid, and saved to
+    it otherwise. With several `workers` and more than PARALLEL_PARSE_SIZE
+    bytes to parse, the blocks of all exports are parsed in a process pool
+    while earlier exports are aggregated, with the same results.
+    """
+    results = [None] * len(filenames)
+    fingerprints = [None] * len(filenames)
+    for i, filename in enumerate(filenames):
+        if use_sidecar:
+            fingerprints[i] = sidecar.fingerprint(filename)
+            results[i] = sidecar.load(filename, sketch_k, fingerprints[i])
+    to_parse = [i for i, result in enumerate(results) if result is None]
+
+    pool = None
+    if workers > 1 and (sum(os.path.getsize(filenames[i]) for i in to_parse)
+                        > PARALLEL_PARSE_SIZE):
+        # Blocks are parsed in order across all exports, and grouped back by
+        # export. An export's blocks are found while earlier ones are parsed.
+        pool = Pool(workers)
+        parsed = ordered_map(
+            pool, parse_range,
+            ((i, block_range) for i in to_parse
+             for block_range in block_ranges(filenames[i])),
+            2 * workers)
+        groups = groupby(parsed, key=lambda pair: pair[0])
+        group = next(groups, None)
+    try:
+        for i in to_parse:
+            filename = filenames[i]
+            if pool is None:
+                parsed_blocks = map(parse_block, read_blocks(filename))
+            elif group is not None and group[0] == i:
+                parsed_blocks = (result for (_, result) in group[1])
             else:
-                data[key] = [float(exec_time_ns)]
-    print("  - read {} rows about {} zones from {}".format(rows, len(data),
-                                                           filename))
-    return data
+                # An export with no events has no blocks
+                parsed_blocks = iter(())
+            codes = dict()
+            chunks = renumber(parsed_blocks, codes)
+            if sketch_k is None:
+                chunks = list(chunks)
+                rows, *stats = exact_stats(chunks, len(codes))
+            else:
+                rows, *stats = sketch_stats(chunks, codes, sketch_k)
+            results[i] = (rows, list(codes), stats)
+            if pool is not None and group is not None and group[0] == i:
+                group = next(groups, None)
+            if use_sidecar:
+                try:
+                    sidecar.save(filename, sketch_k, fingerprints[i],
+                                 *results[i])
+                except OSError as e:
+                    print("  - could not write sidecar for {}: {}"
+                          .format(filename, e), file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    runs = []
+    for filename, (rows, keys, stats) in zip(filenames, results):
+        print("  - read {} rows about {} zones from {}".format(
+            rows, len(keys), filename))
+        runs.append({key: ZoneStats(*zone_stats)
+                     for key, zone_stats in zip(keys, zip(*stats))})
+    return runs
+
+
+def rollup(run, group_of):
+    """
+    Aggregate a run's ZoneStats into groups of zones, where `group_of` maps a
+    zone's key to its group's key. Returns the ZoneStats of each group, in
+    order of first appearance. Events and sums add up. Quantiles are those of
+    the merged times of the group's zones that have distributions (that is,
+    at least 3 events), computed for all groups with one sort, as in
+    `exact_stats`, and are None for groups with fewer than 3 such times.
+    Merged sketches weigh each item by the events it stands for, as
+    `KllSketch.quantile` does.
+    """
+    groups = dict()
+    zone_groups = np.array([groups.setdefault(group_of(key), len(groups))
+                            for key in run], dtype=np.int64)
+    num_groups = len(groups)
+    stats = list(run.values())
+    events = np.bincount(zone_groups, minlength=num_groups,
+                         weights=[s.events for s in stats])
+    sums = np.bincount(zone_groups, minlength=num_groups,
+                       weights=[s.sum for s in stats])
+    rank_errors = [None] * num_groups
+    for group, s in zip(zone_groups.tolist(), stats):
+        if s.rank_error is not None:
+            rank_errors[group] = max(rank_errors[group] or 0.0, s.rank_error)
+
+    with_times = [i for i, s in enumerate(stats) if s.distribution is not None]
+    distributions = [stats[i].distribution for i in with_times]
+    lengths = [len(d.values) for d in distributions]
+    times = np.concatenate([d.values for d in distributions] + [np.zeros(0)])
+    time_groups = np.repeat(zone_groups[with_times], lengths)
+    # Each distribution is sorted, so the stable sort by time mostly merges
+    by_time = np.argsort(times, kind="stable")
+    order = by_time[zone_order(time_groups[by_time], num_groups)]
+    times = times[order]
+    counts = np.bincount(time_groups, minlength=num_groups)
+    starts = np.cumsum(counts) - counts
+    compared = np.flatnonzero(counts > 2)
+    quantiles = [[None] * num_groups for _ in QUANTILES]
+    group_distributions = [None] * num_groups
+
+    if all(d.cumulative_weights is None for d in distributions):
+        for (i, n), out in zip(QUANTILES, quantiles):
+            values = group_quantile(times, starts[compared],
+                                    counts[compared], i, n)
+            for group, value in zip(compared.tolist(), values.tolist()):
+                out[group] = value
+        for group in compared.tolist():
+            group_distributions[group] = Distribution(
+                times[starts[group]:starts[group] + counts[group]], None)
+    else:
+        weights = np.concatenate(
+            [np.ones(len(d.values), dtype=np.int64)
+             if d.cumulative_weights is None
+             else np.diff(d.cumulative_weights, prepend=0)
+             for d in distributions])[order]
+        cumulative = np.cumsum(weights)
+        ends = starts + counts
+        # Events before and within each group
+        before = np.where(starts > 0, cumulative[starts - 1], 0)
+        totals = np.where(counts > 0, cumulative[ends - 1], 0) - before
+        for (i, n), out in zip(QUANTILES, quantiles):
+            index = np.searchsorted(cumulative,
+                                    before[compared] + i / n *
+                                    totals[compared])
+            index = np.minimum(index, ends[compared] - 1)
+            for group, value in zip(compared.tolist(),
+                                    times[index].tolist()):
+                out[group] = value
+        for group in compared.tolist():
+            group_distributions[group] = Distribution(
+                times[starts[group]:ends[group]],
+                cumulative[starts[group]:ends[group]] - before[group])
+
+    return {key: ZoneStats(*group_stats) for key, group_stats in zip(
+        groups, zip([int(e) for e in events.tolist()], sums.tolist(),
+                    *quantiles, rank_errors, group_distributions))}
+
+
+def combine_runs(runs):
+    """
+    Gather the ZoneStats of each zone across runs, as returned by
+    `read_files`. A zone missing from a run has no events in it. Zones are in
+    order of first appearance.
+    """
+    missing = ZoneStats(0, 0.0, None, None, None, None, None)
+    zones = dict()
+    for run in runs:
+        for key in run:
+            zones.setdefault(key, None)
+    return {key: [run.get(key, missing) for run in runs] for key in zones}
+
+
+def mean_stats(runs):
+    """
+    Average a zone's ZoneStats over runs. Quantiles are averaged over the
+    runs that have them, and are None if none do. For a single run this is
+    the run's own ZoneStats.
+    """
+    if len(runs) == 1:
+        return runs[0]
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return sum(values) / len(values) if values else None
+    rank_errors = [s.rank_error for s in runs if s.rank_error is not None]
+    return ZoneStats(events=mean(s.events for s in runs),
+                     sum=mean(s.sum for s in runs),
+                     median=mean(s.median for s in runs),
+                     p90=mean(s.p90 for s in runs),
+                     p99=mean(s.p99 for s in runs),
+                     rank_error=max(rank_errors, default=None),
+                     distribution=None)
+
+
+def zone_intervals(old_runs, new_runs, resamples, confidence, rng):
+    """
+    Bootstrap confidence intervals of the change in a zone's median, p90, sum
+    and number of events between two lists of per-run ZoneStats, as Measures
+    fields. Medians and p90s are resampled from the runs with distributions,
+    and their intervals are None if either side has none.
+    """
+    intervals = dict()
+    stats = dict()
+    for side, runs in [("old", old_runs), ("new", new_runs)]:
+        distributions = [s.distribution for s in runs
+                         if s.distribution is not None]
+        stats[side] = {"median": None, "p90": None}
+        if distributions:
+            run_draws = resample_runs(len(distributions), resamples, rng)
+            stats[side]["median"] = resample_quantiles(distributions, 0.5,
+                                                       run_draws, rng)
+            stats[side]["p90"] = resample_quantiles(distributions, 0.9,
+                                                    run_draws, rng)
+        run_draws = resample_runs(len(runs), resamples, rng)
+        stats[side]["sum"] = resample_means([s.sum for s in runs], run_draws)
+        stats[side]["events"] = resample_means([s.events for s in runs],
+                                               run_draws)
+    for measure in Measures._fields:
+        if stats["old"][measure] is None or stats["new"][measure] is None:
+            intervals[measure] = None
+        else:
+            intervals[measure] = interval(stats["old"][measure],
+                                          stats["new"][measure], confidence)
+    return intervals
 
 
 def chk_diff(old, new, pct_lim, abs_lim):
+    if old is None or new is None:
+        # Groups of zones with too few events each have no quantiles
+        return Measure(old=None, new=None, diff=None, pct=None, flag=False)
     diff = int(new - old)
     pct = (diff / (1.0 + old)) * 100.0
     flag = (new >= abs_lim and pct >= pct_lim)
@@ -40,35 +592,90 @@ def chk_diff(old, new, pct_lim, abs_lim):
                    diff=diff, pct=int(pct))
 
 
-def filter_zone_changes(old, new, pct_lim, zone_lim, sum_lim, evt_lim):
-    print(("  - showing all zones with pct_lim={:,d}, zone_lim={:s}, " +
-           "sum_lim={:s} and evt_lim={:,d}\n")
-          .format(pct_lim, fmt_time(zone_lim), fmt_time(sum_lim), evt_lim))
-    out = []
-    for (zone, new_data) in new.items():
+def init_compare(old, new, resamples, confidence):
+    """
+    Pool initializer. Keeps the combined runs being compared, which a forked
+    worker shares with its parent rather than receiving with each task.
+    """
+    global COMPARE_RUNS
+    COMPARE_RUNS = (old, new, resamples, confidence)
+
+
+def test_zone(item):
+    """
+    Bootstrap confidence intervals of the changes in a zone, given as its
+    index in the new runs and its key. Each zone's resamples are seeded by
+    its index, so the results do not depend on which worker computes them.
+    """
+    index, zone = item
+    old, new, resamples, confidence = COMPARE_RUNS
+    rng = np.random.default_rng([BOOTSTRAP_SEED, index])
+    return zone_intervals(old[zone], new[zone], resamples, confidence, rng)
+
+
+def fmt_zone(key):
+    return "{} @ {}:{}".format(*key)
+
+
+def filter_zone_changes(old, new, pct_lim, zone_lim, sum_lim, evt_lim,
+                        resamples=DEFAULT_RESAMPLES,
+                        confidence=DEFAULT_CONFIDENCE, workers=1,
+                        label=fmt_zone):
+    """
+    Compare zones between two lists of runs, as returned by `read_files`
+    (or groups of zones, as returned by `rollup`). With more than one run on
+    either side, statistics are averaged over runs and a change is flagged
+    only if its bootstrap confidence interval also excludes zero. Intervals
+    are computed by `workers` processes. Changes are named by `label`.
+    """
+    test = len(old) > 1 or len(new) > 1
+    old = combine_runs(old)
+    new = combine_runs(new)
+    candidates = []
+    for index, (zone, new_runs) in enumerate(new.items()):
         if zone in old.keys():
-            old_data = old[zone]
-            old_evt = len(old_data)
-            new_evt = len(new_data)
+            old_runs = old[zone]
+            old_stats = mean_stats(old_runs)
+            new_stats = mean_stats(new_runs)
+            old_evt = old_stats.events
+            new_evt = new_stats.events
             if old_evt > 2 and new_evt > 2:
                 if old_evt < evt_lim and new_evt < evt_lim:
                     continue
-                old_sum = sum(old_data)
-                new_sum = sum(new_data)
+                old_sum = old_stats.sum
+                new_sum = new_stats.sum
                 if old_sum < sum_lim and new_sum < sum_lim:
                     continue
-                # Quantiles returns an n-1 cutpoint list qq, so median is
-                # at qq[4] and p90 is at qq[8].
-                old_qq = statistics.quantiles(old_data, n=10)
-                new_qq = statistics.quantiles(new_data, n=10)
-                m1 = chk_diff(old_qq[4], new_qq[4], pct_lim, zone_lim)
-                m2 = chk_diff(old_qq[8], new_qq[8], pct_lim, zone_lim)
+                m1 = chk_diff(old_stats.median, new_stats.median, pct_lim,
+                              zone_lim)
+                m2 = chk_diff(old_stats.p90, new_stats.p90, pct_lim, zone_lim)
                 m3 = chk_diff(old_sum, new_sum, pct_lim, sum_lim)
                 m4 = chk_diff(old_evt, new_evt, pct_lim, evt_lim)
-                if m1.flag or m2.flag or m3.flag or m4.flag:
-                    ms = Measures(median=m1, p90=m2, sum=m3, events=m4)
-                    z = "{} @ {}:{}".format(*zone)
-                    out.append(Changes(zone=z, measures=ms))
+                ms = Measures(median=m1, p90=m2, sum=m3, events=m4)
+                if any(m.flag for m in ms):
+                    candidates.append((index, zone, ms))
+
+    if test:
+        tested = [(index, zone) for (index, zone, _) in candidates]
+        if workers > 1 and len(tested) > 1:
+            with Pool(workers, init_compare,
+                      (old, new, resamples, confidence)) as p:
+                intervals = p.map(test_zone, tested)
+        else:
+            init_compare(old, new, resamples, confidence)
+            intervals = list(map(test_zone, tested))
+        candidates = [
+            (index, zone, Measures(*[m._replace(
+                ci=measure_intervals[k],
+                flag=m.flag and is_significant(measure_intervals[k]))
+                for k, m in ms._asdict().items()]))
+            for (index, zone, ms), measure_intervals
+            in zip(candidates, intervals)]
+
+    out = []
+    for (_, zone, ms) in candidates:
+        if any(m.flag for m in ms):
+            out.append(Changes(zone=label(zone), measures=ms, key=zone))
     return out
 
 
@@ -87,6 +694,12 @@ def fmt_time(ns):
         return "{:n} nsec".format(int(ns))
 
 
+def fmt_interval(ci, fmt):
+    if ci is None:
+        return "-"
+    return "[{}, {}]".format(fmt(ci[0]), fmt(ci[1]))
+
+
 def fmt_flag(flag):
     if flag:
         return "🛑"
@@ -94,14 +707,117 @@ def fmt_flag(flag):
         return "✅"
 
 
-def main():
+def print_changes(out, ci_header):
+    """
+    Print the Changes in `out` as markdown tables, sorted by the change in
+    their sums. Measures with intervals get a column headed `ci_header`.
+    """
+    for c in sorted(out, key=lambda v: v.measures.sum.pct):
+        with_ci = c.measures.sum.ci is not None
+        print("\n### {}".format(c.zone))
+        print(("| {:>8s} | {:>15s} | {:>15s} " +
+               "| {:>15s} | {:>15s} | {:<5s} ").format(
+                   "measure", "old", "new",
+                   "diff", "diff %",
+                   ci_header.rjust(25) + " | flag" if with_ci else "flag"))
+        print("|---------:|----------------:|----------------:" +
+              "|----------------:|----------------:|" +
+              ("--------------------------:|" if with_ci else "") +
+              ":------|")
+        for k, m in c.measures._asdict().items():
+            if k == "events":
+                ci = (fmt_interval(m.ci, lambda v: "{:n}".format(round(v)))
+                      if with_ci else "")
+                print(("| {:>8.8s} | {:15n} | {:15n} " +
+                       "| {:15n} | {:14n}% | {}{:<5s} |").format(
+                           k, m.old, m.new, m.diff, m.pct,
+                           ci.rjust(25) + " | " if with_ci else "",
+                           fmt_flag(m.flag)))
+            elif m.old is None:
+                ci = fmt_interval(m.ci, fmt_time) if with_ci else ""
+                print(("| {:>8.8s} | {:>15s} | {:>15s} " +
+                       "| {:>15s} | {:>15s} | {}{:<5s} |").format(
+                            k, "-", "-", "-", "-",
+                            ci.rjust(25) + " | " if with_ci else "",
+                            fmt_flag(m.flag)))
+            else:
+                ci = fmt_interval(m.ci, fmt_time) if with_ci else ""
+                print(("| {:>8.8s} | {:>15s} | {:>15s} " +
+                       "| {:>15s} | {:14n}% | {}{:<5s} |").format(
+                            k, fmt_time(m.old), fmt_time(m.new),
+                            fmt_time(m.diff), m.pct,
+                            ci.rjust(25) + " | " if with_ci else "",
+                            fmt_flag(m.flag)))
 
-    # construct the argument parse and parse the arguments
-    argument_parser = argparse.ArgumentParser()
-    argument_parser.add_argument("--old", required=True,
-                                 help="old CSV file")
-    argument_parser.add_argument("--new", required=True,
-                                 help="new CSV file")
+
+def gate_zone_changes(keys, latest, window, pct_lim, zone_lim, sum_lim,
+                      evt_lim):
+    """
+    Compare the latest build's statistics with the median of each statistic
+    over a window of earlier builds, as arrays of shape (zones, STATS) and
+    (zones, builds, STATS) from `History.stats`. Limits apply as in
+    `filter_zone_changes`, and a change is flagged only if it also leaves the
+    statistic's noise band: GATE_SPREADS robust standard deviations (scaled
+    median absolute deviations over the window) around the median. Returns
+    Changes whose intervals are those bands, and their keys.
+    """
+    with warnings.catch_warnings():
+        # Zones missing from the whole window have all-NaN slices
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        baseline = np.nanmedian(window, axis=1)
+        spread = MAD_TO_STDDEV * np.nanmedian(
+            np.abs(window - baseline[:, np.newaxis]), axis=1)
+    low = baseline - GATE_SPREADS * spread
+    high = baseline + GATE_SPREADS * spread
+    columns = {name: i for i, name in enumerate(HISTORY_STATS)}
+    limits = {"median": zone_lim, "p90": zone_lim, "p99": zone_lim,
+              "sum": sum_lim, "events": evt_lim}
+    out = []
+    out_keys = []
+    for zone in range(len(keys)):
+        old_evt = baseline[zone, columns["events"]]
+        new_evt = latest[zone, columns["events"]]
+        # NaN compares false, so zones missing on either side are skipped
+        if not (old_evt > 2 and new_evt > 2):
+            continue
+        if old_evt < evt_lim and new_evt < evt_lim:
+            continue
+        if (baseline[zone, columns["sum"]] < sum_lim and
+                latest[zone, columns["sum"]] < sum_lim):
+            continue
+        measures = dict()
+        for name in GateMeasures._fields:
+            i = columns[name]
+            m = chk_diff(baseline[zone, i], latest[zone, i], pct_lim,
+                         limits[name])
+            measures[name] = m._replace(
+                ci=(float(low[zone, i]), float(high[zone, i])),
+                flag=bool(m.flag and latest[zone, i] > high[zone, i]))
+        ms = GateMeasures(**measures)
+        if any(m.flag for m in ms):
+            out.append(Changes(zone="{} @ {}:{}".format(*keys[zone]),
+                               measures=ms))
+            out_keys.append(keys[zone])
+    return out, out_keys
+
+
+def add_read_arguments(argument_parser):
+    argument_parser.add_argument("--sketch-k", type=int, metavar="K",
+                                 help="estimate medians and p90s with a KLL "
+                                 "sketch of capacity K per zone (e.g. 512), "
+                                 "so memory does not grow with the number "
+                                 "of events")
+    argument_parser.add_argument("--workers", default=WORKERS, type=int,
+                                 help="number of worker processes parsing "
+                                 "CSV files larger than {} MB in all and "
+                                 "testing zones (default: the number of "
+                                 "CPUs)".format(PARALLEL_PARSE_SIZE >> 20))
+    argument_parser.add_argument("--no-sidecar", action="store_true",
+                                 help="neither read nor write the cached "
+                                 "aggregates kept next to each CSV file")
+
+
+def add_limit_arguments(argument_parser):
     argument_parser.add_argument("--pct-lim", default=10, type=int,
                                  help="limit to deltas >= given percent")
     argument_parser.add_argument("--zone-lim", default=1000, type=int,
@@ -111,39 +827,217 @@ def main():
     argument_parser.add_argument("--evt-lim", default=1000, type=int,
                                  help="limit to event delta >= given count")
 
+
+def print_rank_error(runs, sketch_k):
+    if sketch_k is not None:
+        rank_error = max([s.rank_error for run in runs
+                          for s in run.values()], default=0.0)
+        print(("  - estimated medians and p90s with KLL sketches (k={:d}), " +
+               "rank error at most {:.2%} with {:.0%} confidence")
+              .format(sketch_k, rank_error, SKETCH_CONFIDENCE))
+
+
+def record(argv):
+    """ Record the per-zone statistics of a build in a history database. """
+    argument_parser = argparse.ArgumentParser(
+        prog="DiffTracyCSV.py record", description=record.__doc__)
+    argument_parser.add_argument("--db", required=True,
+                                 help="SQLite history database, created if "
+                                 "it does not exist")
+    argument_parser.add_argument("--build", required=True,
+                                 help="name of the build, such as a commit")
+    argument_parser.add_argument("--replace", action="store_true",
+                                 help="replace the statistics of a build "
+                                 "that is already recorded")
+    argument_parser.add_argument("csv", nargs="+",
+                                 help="CSV file, or several CSV files from "
+                                 "repeated runs, of the build")
+    add_read_arguments(argument_parser)
+    args = argument_parser.parse_args(argv)
+
+    print("\n### Tracy zone-timing record\n")
+    runs = read_files(args.csv, args.sketch_k, not args.no_sidecar,
+                      args.workers)
+    print_rank_error(runs, args.sketch_k)
+    zones = {key: tuple(getattr(mean_stats(zone_runs), name)
+                        for name in ZONE_HISTORY_FIELDS)
+             for key, zone_runs in combine_runs(runs).items()}
+    history = History(args.db)
+    try:
+        history.record(args.build, len(runs), zones, args.replace)
+    except ValueError as e:
+        argument_parser.error(str(e))
+    finally:
+        history.close()
+    print("  - recorded {:d} zones of build {} in {}"
+          .format(len(zones), args.build, args.db))
+
+
+def gate(argv):
+    """
+    Compare a build with a window of earlier builds in a history database.
+    Exits with status 1 if any zone regressed.
+    """
+    argument_parser = argparse.ArgumentParser(
+        prog="DiffTracyCSV.py gate", description=gate.__doc__)
+    argument_parser.add_argument("--db", required=True,
+                                 help="SQLite history database")
+    argument_parser.add_argument("--build",
+                                 help="build to check (default: the latest)")
+    argument_parser.add_argument("--window", default=10, type=int,
+                                 help="number of earlier builds to compare "
+                                 "with (default: 10)")
+    argument_parser.add_argument("--json", metavar="PATH",
+                                 help="also write the results as JSON to "
+                                 "PATH, or to stdout if PATH is -")
+    add_limit_arguments(argument_parser)
+    args = argument_parser.parse_args(argv)
+
+    history = History(args.db)
+    try:
+        build, baseline = history.window(args.build, args.window)
+        keys, values = history.stats(baseline + [build])
+    except ValueError as e:
+        argument_parser.error(str(e))
+    finally:
+        history.close()
+    if not baseline:
+        argument_parser.error("build {} has no earlier builds to compare "
+                              "with".format(build))
+
+    markdown = sys.stderr if args.json == "-" else sys.stdout
+    with contextlib.redirect_stdout(markdown):
+        print("\n### Tracy zone-timing gate\n")
+        print("  - comparing build {} with the median of {:d} earlier "
+              "builds, from {} to {}"
+              .format(build, len(baseline), baseline[0], baseline[-1]))
+        print(("  - showing zones above their noise band over those builds " +
+               "(median + {:g} robust standard deviations) with " +
+               "pct_lim={:,d}, zone_lim={:s}, sum_lim={:s} and " +
+               "evt_lim={:,d}\n")
+              .format(GATE_SPREADS, args.pct_lim, fmt_time(args.zone_lim),
+                      fmt_time(args.sum_lim), args.evt_lim))
+        out, out_keys = gate_zone_changes(
+            keys, values[:, -1], values[:, :-1], args.pct_lim, args.zone_lim,
+            args.sum_lim, args.evt_lim)
+        if len(out) == 0:
+            print("**No zone regressions exceed limits**")
+        else:
+            print_changes(out, "window noise band")
+
+    if args.json is not None:
+        result = {
+            "build": build,
+            "baseline": baseline,
+            "limits": {"pct_lim": args.pct_lim, "zone_lim": args.zone_lim,
+                       "sum_lim": args.sum_lim, "evt_lim": args.evt_lim},
+            "regressions": [
+                {"name": key[0], "src_file": key[1], "src_line": key[2],
+                 "measures": {k: {"baseline": m.old, "latest": m.new,
+                                  "diff": m.diff, "pct": m.pct,
+                                  "noise_band": list(m.ci), "flag": m.flag}
+                              for k, m in c.measures._asdict().items()}}
+                for c, key in sorted(zip(out, out_keys),
+                                     key=lambda v: v[0].measures.sum.pct)]}
+        if args.json == "-":
+            json.dump(result, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
+    return 1 if out else 0
+
+
+def main():
+    if sys.argv[1:2] == ["record"]:
+        return record(sys.argv[2:])
+    if sys.argv[1:2] == ["gate"]:
+        return gate(sys.argv[2:])
+
+    # construct the argument parse and parse the arguments
+    argument_parser = argparse.ArgumentParser(
+        epilog="Run with `record` or `gate` as the first argument to keep a "
+        "history of builds, and see their --help.")
+    argument_parser.add_argument("--old", required=True, nargs="+",
+                                 help="old CSV file, or several CSV files "
+                                 "from repeated runs")
+    argument_parser.add_argument("--new", required=True, nargs="+",
+                                 help="new CSV file, or several CSV files "
+                                 "from repeated runs")
+    add_limit_arguments(argument_parser)
+    add_read_arguments(argument_parser)
+    argument_parser.add_argument("--rollup", action="append", default=[],
+                                 choices=list(ROLLUPS),
+                                 help="also compare zones grouped by source "
+                                 "file, directory or name; may be repeated")
+    argument_parser.add_argument("--resamples", default=DEFAULT_RESAMPLES,
+                                 type=int,
+                                 help="number of bootstrap resamples when "
+                                 "comparing several runs")
+    argument_parser.add_argument("--confidence", default=DEFAULT_CONFIDENCE,
+                                 type=float,
+                                 help="confidence of the bootstrap intervals "
+                                 "when comparing several runs")
+
     args = argument_parser.parse_args()
 
     print("\n### Tracy zone-timing comparison\n")
 
-    old = read_file(args.old)
-    new = read_file(args.new)
+    runs = read_files(args.old + args.new, args.sketch_k,
+                      not args.no_sidecar, args.workers)
+    old = runs[:len(args.old)]
+    new = runs[len(args.old):]
+    print_rank_error(runs, args.sketch_k)
+    if len(old) > 1 or len(new) > 1:
+        print(("  - comparing means over {:d} old and {:d} new runs, " +
+               "flagging only changes whose {:.0%} bootstrap confidence " +
+               "interval ({:,d} resamples) excludes zero")
+              .format(len(old), len(new), args.confidence, args.resamples))
+    print(("  - showing all zones with pct_lim={:,d}, zone_lim={:s}, " +
+           "sum_lim={:s} and evt_lim={:,d}\n")
+          .format(args.pct_lim, fmt_time(args.zone_lim),
+                  fmt_time(args.sum_lim), args.evt_lim))
+    ci_header = "{:.0%} CI of diff".format(args.confidence)
     out = filter_zone_changes(old, new, args.pct_lim, args.zone_lim,
-                              args.sum_lim, args.evt_lim)
+                              args.sum_lim, args.evt_lim, args.resamples,
+                              args.confidence, args.workers)
 
     if len(out) == 0:
         print("**No zone changes exceed limits**")
     else:
-        out.sort(key=lambda v: v.measures.sum.pct)
-        for c in out:
-            print("\n### {}".format(c.zone))
-            print(("| {:>8s} | {:>15s} | {:>15s} " +
-                   "| {:>15s} | {:>15s} | {:<5s} ").format(
-                       "measure", "old", "new",
-                       "diff", "diff %", "flag"))
-            print("|---------:|----------------:|----------------:" +
-                  "|----------------:|----------------:|:------|")
-            for k, m in c.measures._asdict().items():
-                if k == "events":
-                    print(("| {:>8.8s} | {:15n} | {:15n} " +
-                           "| {:15n} | {:14n}% | {:<5s} |").format(
-                               k, m.old, m.new, m.diff,
-                               m.pct, fmt_flag(m.flag)))
-                else:
-                    print(("| {:>8.8s} | {:>15s} | {:>15s} " +
-                           "| {:>15s} | {:14n}% | {:<5s} |").format(
-                                k, fmt_time(m.old), fmt_time(m.new),
-                                fmt_time(m.diff), m.pct, fmt_flag(m.flag)))
+        print_changes(out, ci_header)
+
+    flagged = {c.key for c in out}
+    for level in args.rollup:
+        group_of = ROLLUPS[level]
+        members = dict()
+        for run in old + new:
+            for key in run:
+                members.setdefault(group_of(key), set()).add(key)
+
+        def label(group):
+            zones = members[group]
+            alone = len(zones & flagged)
+            return "{} ({:d} zone{}, {})".format(
+                group, len(zones), "" if len(zones) == 1 else "s",
+                "{:d} flagged on their own".format(alone) if alone
+                else "none flagged on their own")
+
+        print("\n## Zones rolled up by {}".format(level))
+        group_out = filter_zone_changes(
+            [rollup(run, group_of) for run in old],
+            [rollup(run, group_of) for run in new],
+            args.pct_lim, args.zone_lim, args.sum_lim, args.evt_lim,
+            args.resamples, args.confidence, args.workers, label)
+        hidden = [c for c in group_out if not members[c.key] & flagged]
+        if len(group_out) == 0:
+            print("\n**No {} changes exceed limits**".format(level))
+        else:
+            print("\n  - {:d} {} changes exceed limits, {:d} of them with "
+                  "no zone flagged on its own".format(
+                      len(group_out), level, len(hidden)))
+            print_changes(group_out, ci_header)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -4,17 +4,31 @@
 # under the Apache License, Version 2.0. See the COPYING file at the root
 # of this distribution or at http://www.apache.org/licenses/LICENSE-2.0
 
+import argparse
 from base64 import b64decode
-import csv
+from contextlib import redirect_stdout
+from functools import partial
+import io
 import json
 from multiprocessing.pool import Pool
-from typing import Any, Optional, Tuple
+from typing import Any, Iterable, Optional, Tuple
 import subprocess
 import sys
+import time
 
 import numpy as np
 import numpy.typing as npt
 
+from histogram_generator.cache import EnvelopeCache, envelope_key
+from histogram_generator.histogram import LogLinearHistogram
+from histogram_generator.loader import (Batch, Shard, read_batches,
+                                        read_shard, shards)
+from histogram_generator.state import (HistogramState, Segment,
+                                       format_timestamp, parse_timestamp,
+                                       to_unix_timestamps)
+from histogram_generator.stream_decoder import StreamDecoder
+import histogram_generator.xdr as xdr
+
 # Sample query to gather history_transactions data:
 # SELECT soroban_resources_instructions, soroban_resources_write_bytes, tx_envelope FROM `crypto-stellar.crypto_stellar.history_transactions` WHERE batch_run_date BETWEEN DATETIME("2024-06-24") AND DATETIME("2024-09-24") AND soroban_resources_instructions > 0
 
@@ -23,7 +37,9 @@ import numpy.typing as npt
 # NOTE: this query filters out anything that isn't a write_entry. This is
 # required for the script to work correctly!
 
-# Threads to use for parallel processing
+# To update a state file with --state, also select closed_at in both queries.
+
+# Default number of worker processes to use for parallel processing
 WORKERS=9
 
 # Maximum number of histogram bins to generate
@@ -35,6 +51,46 @@ MAX_BINS=100
 # of bins until there are at most MAX_OUTPUT_BINS bins with nonzero values.
 MAX_OUTPUT_BINS=10
 
+# Number of values in each input of --benchmark-histogram
+BENCHMARK_VALUES=10_000_000
+
+# Number of rows sent to a worker at a time. Each worker with a streaming
+# decoder has at most this many envelopes in flight to its decoder process.
+BATCH_SIZE=256
+
+# Columns read from the history_transactions and history_contract_events
+# tables. Other columns in the input are ignored.
+HISTORY_COLUMNS = ["tx_envelope",
+                   "soroban_resources_instructions",
+                   "soroban_resources_write_bytes"]
+EVENT_COLUMNS = ["data_decoded"]
+
+# Column holding the close time of a row's ledger in both tables. Only read
+# when updating a state file.
+TIMESTAMP_COLUMN = "closed_at"
+
+# Envelope decoders. "native" decodes in process, "stellar-xdr" starts a
+# stellar-xdr process per envelope, and "stellar-xdr-stream" keeps one
+# stellar-xdr process running per worker.
+DECODERS = ["native", "stellar-xdr", "stellar-xdr-stream"]
+
+# The StreamDecoder owned by this worker process, when decoding with
+# "stellar-xdr-stream"
+STREAM_DECODER = None
+
+# The EnvelopeCache opened by this worker process, when caching processed rows
+ENVELOPE_CACHE = None
+
+# Histograms generated from the history_transactions table, in output order,
+# along with their output titles
+HISTORY_METRICS = [("instructions", "Instructions"),
+                   ("write_kilobytes", "I/O Kilobytes"),
+                   ("tx_size", "Transaction Size Bytes"),
+                   ("wasm_size", "Wasm Size Bytes")]
+
+# Histograms generated from the history_contract_events table
+EVENT_METRICS = [("data_entries", "Data Entries")]
+
 def decode_xdr(xdr: str) -> dict[str, Any]:
     """ Decode a TransactionEnvelope using the stellar-xdr tool. """
     decoded = subprocess.check_output(
@@ -46,53 +102,255 @@ def decode_xdr(xdr: str) -> dict[str, Any]:
             input=xdr.encode("utf-8"))
     return json.loads(decoded)
 
-def process_history_row(row: dict[str, str]) -> Tuple[Optional[Tuple[int, int, int]], Optional[int]]:
+def init_worker(decoder: str, cache_path: Optional[str] = None) -> None:
+    """
+    Pool initializer. Starts this worker's streaming decoder and opens its
+    connection to the envelope cache, if any.
+    """
+    global STREAM_DECODER, ENVELOPE_CACHE
+    if decoder == "stellar-xdr-stream":
+        STREAM_DECODER = StreamDecoder(decode_xdr)
+    if cache_path is not None:
+        ENVELOPE_CACHE = EnvelopeCache(cache_path)
+
+def summarize_envelopes(envelopes: list[str],
+                        decoder: str = "native") -> list[xdr.EnvelopeSummary]:
+    """ Summarize a batch of base64 encoded TransactionEnvelopes. """
+    if decoder == "stellar-xdr-stream":
+        return [xdr.summarize_json(envelope)
+                for envelope in STREAM_DECODER.decode(envelopes)]
+    if decoder == "stellar-xdr":
+        return [xdr.summarize_json(decode_xdr(envelope))
+                for envelope in envelopes]
+    return [xdr.summarize_envelope(b64decode(envelope, validate=True))
+            for envelope in envelopes]
+
+def new_histograms(names: Iterable[str]) -> dict[str, LogLinearHistogram]:
+    """ Create an empty histogram for each name in `names`. """
+    return {name: LogLinearHistogram() for name in names}
+
+def merge_histograms(into: dict[str, LogLinearHistogram],
+                     other: dict[str, LogLinearHistogram]) -> None:
+    """ Merge each histogram in `other` into the histogram of the same name. """
+    for name, histogram in other.items():
+        into.setdefault(name, LogLinearHistogram()).merge(histogram)
+
+def timestamp_histogram(closed_at: list[Any]) -> LogLinearHistogram:
+    """
+    Histogram of `closed_at` values as Unix timestamps. Only its exact minimum
+    and maximum are used, as the time range of the rows it was built from.
     """
-    Process a row from the history_transactions table. Returns:
+    histogram = LogLinearHistogram()
+    histogram.record(to_unix_timestamps(closed_at))
+    return histogram
+
+def process_history_batch(batch: Batch,
+                          decoder: str = "native") -> dict[str, LogLinearHistogram]:
+    """
+    Process a batch of rows from the history_transactions table into a
+    histogram for each metric in HISTORY_METRICS, plus one of TIMESTAMP_COLUMN
+    if the batch has that column. Rows found in this worker's envelope cache
+    are not decoded.
+    """
+    rows = list(zip(batch["tx_envelope"],
+                    batch["soroban_resources_instructions"],
+                    batch["soroban_resources_write_bytes"]))
+    if ENVELOPE_CACHE is None:
+        envelopes = summarize_envelopes(batch["tx_envelope"], decoder)
+        processed_rows = [process_history_row(*row, envelope)
+                          for row, envelope in zip(rows, envelopes)]
+    else:
+        keys = [envelope_key(row[0]) for row in rows]
+        cached = ENVELOPE_CACHE.lookup(keys)
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        envelopes = summarize_envelopes([rows[i][0] for i in misses],
+                                        decoder)
+        for i, envelope in zip(misses, envelopes):
+            cached[keys[i]] = process_history_row(*rows[i], envelope)
+        ENVELOPE_CACHE.store((keys[i], cached[keys[i]]) for i in misses)
+        processed_rows = [cached[key] for key in keys]
+    invokes = [i for (i, u) in processed_rows if i is not None]
+    wasms = [u for (i, u) in processed_rows if u is not None]
+
+    histograms = new_histograms(name for (name, _) in HISTORY_METRICS)
+    if invokes:
+        # Decompose into instructions, write bytes, and tx size
+        instructions, write_bytes, tx_size = np.array(invokes).T
+        histograms["instructions"].record(instructions)
+        # Convert write_bytes to kilobytes
+        histograms["write_kilobytes"].record(
+            (write_bytes / 1024).round().astype(int))
+        histograms["tx_size"].record(tx_size)
+    histograms["wasm_size"].record(wasms)
+    if TIMESTAMP_COLUMN in batch:
+        histograms[TIMESTAMP_COLUMN] = timestamp_histogram(
+            batch[TIMESTAMP_COLUMN])
+    return histograms
+
+def process_history_shard(shard: Shard, decoder: str = "native",
+                          columns: list[str] = HISTORY_COLUMNS) -> dict[str, LogLinearHistogram]:
+    """
+    Read `columns` of a shard of the history_transactions table, and process
+    them into histograms as `process_history_batch` does.
+    """
+    histograms = new_histograms(name for (name, _) in HISTORY_METRICS)
+    for batch in read_shard(shard, columns, BATCH_SIZE):
+        merge_histograms(histograms, process_history_batch(batch, decoder))
+    return histograms
+
+def process_history_row(envelope_xdr: str,
+                        instructions: str,
+                        write_bytes: str,
+                        envelope: xdr.EnvelopeSummary) -> Tuple[Optional[Tuple[int, int, int]], Optional[int]]:
+    """
+    Process a row from the history_transactions table, given the summary of
+    its envelope. Returns:
     * (None, None) if the row is not a transaction
     * (None, wasm_size) if the row is a wasm upload
     * ((instructions, write_bytes, tx_size), None) if the row is an invoke
       transaction
     """
-    envelope_xdr = row["tx_envelope"]
     assert isinstance(envelope_xdr, str)
-    envelope = decode_xdr(envelope_xdr)
-    if "tx" not in envelope:
+    if not envelope.is_tx:
         # Skip anything that isn't a transaction (such as a fee bump)
         return (None, None)
-    operations = envelope["tx"]["tx"]["operations"]
-    assert len(operations) == 1
-    body = operations[0]["body"]
-    if "invoke_host_function" in body:
-        ihf = body["invoke_host_function"]
-        if "upload_contract_wasm" in ihf["host_function"]:
+    assert envelope.num_operations == 1
+    if envelope.is_invoke:
+        if envelope.wasm_size is not None:
             # Count wasm bytes
-            wasm = ihf["host_function"]["upload_contract_wasm"]
-            return (None, len(bytes.fromhex(wasm)))
+            return (None, envelope.wasm_size)
         else:
             # Treat as a "normal" invoke
-            instructions = row["soroban_resources_instructions"]
-            write_bytes = row["soroban_resources_write_bytes"]
             return ( ( int(instructions),
                        int(write_bytes),
                        len(b64decode(envelope_xdr, validate=True))),
                      None)
     return (None, None)
 
-def process_event_row(row: dict[str, str]) -> int:
+def compare_decoders(history_transactions_csv: str) -> bool:
+    """
+    Check that the in-process and streaming decoders agree with the
+    stellar-xdr tool on every envelope in `history_transactions_csv`. Returns
+    True if they all agree.
     """
-    Process a row from the history_events table. Must already be filtered to
-    contain only write entries. Returns an int with the number of write entries.
+    init_worker("stellar-xdr-stream")
+    mismatches = 0
+    rows = 0
+    for batch in read_batches(history_transactions_csv, ["tx_envelope"],
+                              BATCH_SIZE):
+        envelopes = batch["tx_envelope"]
+        expected = summarize_envelopes(envelopes, "stellar-xdr")
+        streamed = summarize_envelopes(envelopes, "stellar-xdr-stream")
+        for i, envelope in enumerate(envelopes):
+            try:
+                native = summarize_envelopes([envelope])[0]
+            except xdr.XdrError as e:
+                native = e
+            for name, actual in [("in-process", native),
+                                 ("streaming", streamed[i])]:
+                if actual != expected[i]:
+                    mismatches += 1
+                    print(f"Mismatch on row {rows + i + 1}: stellar-xdr "
+                          f"gave {expected[i]}, {name} decoder gave "
+                          f"{actual}")
+        rows += len(envelopes)
+    STREAM_DECODER.close()
+    print(f"Compared {rows} envelopes, found {mismatches} mismatches")
+    return mismatches == 0
+
+def benchmark_decoders(history_transactions_csv: str) -> None:
     """
-    return int(json.loads(row["data_decoded"])["value"])
+    Print the rows per second each decoder achieves on
+    `history_transactions_csv`, using WORKERS worker processes.
+    """
+    batches = [batch["tx_envelope"]
+               for batch in read_batches(history_transactions_csv,
+                                         ["tx_envelope"], BATCH_SIZE)]
+    num_envelopes = sum(len(batch) for batch in batches)
+    for decoder in DECODERS:
+        start = time.perf_counter()
+        with Pool(WORKERS, init_worker, (decoder,)) as p:
+            for _ in p.imap_unordered(partial(summarize_envelopes,
+                                              decoder=decoder), batches):
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"{decoder:>18s}: {num_envelopes / elapsed:12.1f} rows/second")
+
+def process_event_row(data_decoded: str) -> int:
+    """
+    Process the data_decoded column of a row from the history_events table.
+    Must already be filtered to contain only write entries. Returns an int with
+    the number of write entries.
+    """
+    return int(json.loads(data_decoded)["value"])
 
-def to_normalized_histogram(data: npt.ArrayLike) -> None:
+def process_event_batch(batch: Batch) -> dict[str, LogLinearHistogram]:
+    """
+    Process a batch of rows from the history_events table into a histogram for
+    each metric in EVENT_METRICS, plus one of TIMESTAMP_COLUMN if the batch has
+    that column.
+    """
+    histograms = new_histograms(name for (name, _) in EVENT_METRICS)
+    histograms["data_entries"].record(
+        [process_event_row(data_decoded)
+         for data_decoded in batch["data_decoded"]])
+    if TIMESTAMP_COLUMN in batch:
+        histograms[TIMESTAMP_COLUMN] = timestamp_histogram(
+            batch[TIMESTAMP_COLUMN])
+    return histograms
+
+def process_event_shard(shard: Shard,
+                        columns: list[str] = EVENT_COLUMNS) -> dict[str, LogLinearHistogram]:
+    """
+    Read `columns` of a shard of the history_events table, and process them
+    into histograms as `process_event_batch` does.
+    """
+    histograms = new_histograms(name for (name, _) in EVENT_METRICS)
+    for batch in read_shard(shard, columns, BATCH_SIZE):
+        merge_histograms(histograms, process_event_batch(batch))
+    return histograms
+
+def to_normalized_histogram(data: npt.ArrayLike,
+                            weights: Optional[npt.ArrayLike] = None,
+                            value_range: Optional[Tuple[int, int]] = None) -> None:
     """
     Given a set of data, print a normalized histogram with at most
     MAX_OUTPUT_BINS bins formatted for easy pasting into supercluster.
+    `weights` and `value_range` have the same meaning as in `np.histogram`, and
+    the bins match those `np.histogram` would produce.
     """
+    # Sort the data once. The counts for each candidate number of bins then
+    # come from binary searches for the bin edges, rather than from a pass over
+    # all of the data per candidate.
+    data = np.asarray(data)
+    if weights is None:
+        sorted_data = np.sort(data)
+        cumulative = np.arange(len(sorted_data) + 1)
+    else:
+        order = np.argsort(data, kind="stable")
+        sorted_data = data[order]
+        cumulative = np.concatenate(
+            ([0], np.cumsum(np.asarray(weights)[order])))
+
+    if value_range is None:
+        value_range = ((sorted_data[0], sorted_data[-1]) if len(sorted_data)
+                       else (0, 1))
+    # Bin edges depend only on the range and the data's dtype. Convert the data
+    # to the edges' dtype up front, rather than on every search.
+    edges_of = np.array(value_range, dtype=data.dtype)
+    edge_dtype = np.histogram_bin_edges(edges_of, bins=1,
+                                        range=value_range).dtype
+    sorted_data = sorted_data.astype(edge_dtype, copy=False)
+
     for i in range(MAX_BINS, MAX_OUTPUT_BINS-1, -1):
-        hist, bins = np.histogram(data, bins=i)
+        bins = np.histogram_bin_edges(edges_of, bins=i, range=value_range)
+
+        # Each bin holds values in [bins[j], bins[j + 1]), except that the last
+        # bin also holds values equal to bins[-1]
+        starts = np.searchsorted(sorted_data, bins[:-1], side="left")
+        ends = np.append(starts[1:],
+                         np.searchsorted(sorted_data, bins[-1], side="right"))
+        hist = cumulative[ends] - cumulative[starts]
 
         # Add up counts in each bin
         total = np.sum(hist)
@@ -103,18 +361,13 @@ def to_normalized_histogram(data: npt.ArrayLike) -> None:
         # Convert to ints
         normalized = normalized.round().astype(int)
 
-        if len([x for x in normalized if x != 0]) <= MAX_OUTPUT_BINS:
+        if np.count_nonzero(normalized) <= MAX_OUTPUT_BINS:
             break
         # We have too many non-zero output bins. Reduce the number of total bins
         # and try again.
 
-    # Find midpoint of each bin
-    midpoints = np.empty(len(bins) - 1)
-    for i in range(len(bins) - 1):
-        midpoints[i] = (bins[i] + bins[i + 1]) / 2
-
-    # Convert to ints
-    midpoints = midpoints.round().astype(int)
+    # Find midpoint of each bin, and convert to ints
+    midpoints = ((bins[:-1] + bins[1:]) / 2).round().astype(int)
 
     # Format for easy pasting into supercluster
     print("[ ", end="")
@@ -125,70 +378,220 @@ def to_normalized_histogram(data: npt.ArrayLike) -> None:
         print(f"({point}, {count}); ", end="")
     print("]")
 
-def process_soroban_history(history_transactions_csv: str) -> None:
-    """ Generate histograms from data in the history_transactions table. """
-    with open(history_transactions_csv) as f:
-        reader = csv.DictReader(f)
-
-        # Decode XDR in parallel
-        with Pool(WORKERS) as p:
-            processed_rows = p.imap_unordered(process_history_row, reader)
-
-            # Filter to just valid rows
-            valid = [row for row in processed_rows if row != (None, None)]
-
-            # Parse out invokes
-            invokes = [i for (i, u) in valid if i is not None]
-            wasms = [u for (i, u) in valid if u is not None]
-
-            # Decompose into instructions, write bytes, and tx size
-            instructions, write_bytes, tx_size = zip(*invokes)
-
-            print("Instructions:")
-            to_normalized_histogram(instructions)
-
-            # Convert write_bytes to kilobytes
-            write_kilobytes = (np.array(write_bytes) / 1024).round().astype(int)
-            print("\nI/O Kilobytes:")
-            to_normalized_histogram(write_kilobytes)
-
-            print("\nTransaction Size Bytes:")
-            to_normalized_histogram(tx_size)
-
-            print("\nWasm Size Bytes:")
-            to_normalized_histogram(wasms)
-
-def process_soroban_events(history_contract_events_csv) -> None:
+def benchmark_histogram() -> None:
     """
-    Generate a histogram for data entries from data in the
-    history_contract_events table.
+    Print the time `to_normalized_histogram` takes on BENCHMARK_VALUES values
+    from each of several distributions. Uniform values need every candidate
+    number of bins, while log-normal ones stop at the first.
     """
-    with open(history_contract_events_csv) as f:
-        reader = csv.DictReader(f)
-
-        # Process CSV in parallel
-        with Pool(WORKERS) as p:
-            processed_rows = list(p.imap_unordered(process_event_row, reader))
-
-            print("Data Entries:")
-            to_normalized_histogram(processed_rows)
+    rng = np.random.default_rng(0)
+    inputs = [
+        ("uniform", lambda: (rng.uniform(0, 10**6, BENCHMARK_VALUES), None)),
+        ("uniform integers",
+         lambda: (rng.integers(0, 10**6, BENCHMARK_VALUES), None)),
+        ("log-normal", lambda: (rng.lognormal(10, 2, BENCHMARK_VALUES), None)),
+        ("weighted", lambda: (rng.integers(0, 10**6, BENCHMARK_VALUES),
+                              rng.integers(1, 100, BENCHMARK_VALUES))),
+    ]
+    for name, make_input in inputs:
+        data, weights = make_input()
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            to_normalized_histogram(data, weights)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>18s}: {elapsed:8.2f} seconds")
+
+def print_histogram(histogram: LogLinearHistogram) -> None:
+    """
+    Print a LogLinearHistogram in the format of `to_normalized_histogram`. Bins
+    are computed from the histogram's buckets over its exact value range.
+    """
+    if histogram.total() == 0:
+        print("[ ]")
+        return
+    values, weights = histogram.values_and_weights()
+    to_normalized_histogram(values, weights, (histogram.min, histogram.max))
 
-def help_and_exit() -> None:
-    print(f"Usage: {sys.argv[0]} <history_transactions data> "
-          "<history_contract_events data>")
-    print("See the comments at the top of this file for sample Hubble queries "
-          "to generate the appropriate data.")
-    sys.exit(1)
+def print_histograms(histograms: dict[str, LogLinearHistogram]) -> None:
+    """
+    Print the histogram for each metric in HISTORY_METRICS and EVENT_METRICS.
+    """
+    for i, (name, title) in enumerate(HISTORY_METRICS + EVENT_METRICS):
+        if i > 0:
+            print("")
+        print(f"{title}:")
+        print_histogram(histograms[name])
+
+def process_soroban_history(history_transactions_csv: str,
+                            decoder: str = "native",
+                            cache_path: Optional[str] = None,
+                            workers: int = WORKERS,
+                            columns: list[str] = HISTORY_COLUMNS) -> dict[str, LogLinearHistogram]:
+    """
+    Generate histograms from data in the history_transactions table, as
+    `process_history_batch` does. If `cache_path` is given, processed rows are
+    looked up in and added to the envelope cache at that path.
+    """
+    if cache_path is not None:
+        # Create the cache before the workers connect to it
+        EnvelopeCache(cache_path).close()
+
+    # Each worker reads and parses its own shards of the file, and sends back
+    # only histograms, so the parent process never parses a row
+    with Pool(workers, init_worker, (decoder, cache_path)) as p:
+        processed_shards = p.imap_unordered(
+            partial(process_history_shard, decoder=decoder, columns=columns),
+            shards(history_transactions_csv, workers))
+
+        # Merge each shard's histograms as it arrives
+        histograms = new_histograms(name for (name, _) in HISTORY_METRICS)
+        for shard_histograms in processed_shards:
+            merge_histograms(histograms, shard_histograms)
+    return histograms
+
+def process_soroban_events(history_contract_events_csv: str,
+                           workers: int = WORKERS,
+                           columns: list[str] = EVENT_COLUMNS) -> dict[str, LogLinearHistogram]:
+    """
+    Generate histograms from data in the history_contract_events table, as
+    `process_event_batch` does.
+    """
+    # Process shards in parallel
+    histograms = new_histograms(name for (name, _) in EVENT_METRICS)
+    with Pool(workers) as p:
+        for shard_histograms in p.imap_unordered(
+                partial(process_event_shard, columns=columns),
+                shards(history_contract_events_csv, workers)):
+            merge_histograms(histograms, shard_histograms)
+    return histograms
+
+def update_state(state: HistogramState, args: argparse.Namespace) -> None:
+    """
+    Process the input files, including their TIMESTAMP_COLUMN, and add their
+    histograms to `state` as a new segment.
+    """
+    histograms = process_soroban_history(
+        args.history_transactions, args.decoder, args.cache, args.workers,
+        HISTORY_COLUMNS + [TIMESTAMP_COLUMN])
+    merge_histograms(histograms, process_soroban_events(
+        args.history_contract_events, args.workers,
+        EVENT_COLUMNS + [TIMESTAMP_COLUMN]))
+    timestamps = histograms.pop(TIMESTAMP_COLUMN, None)
+    if timestamps is None:
+        print("No rows to add to the state file")
+        return
+    state.add(Segment(timestamps.min, timestamps.max, histograms))
+    print(f"Added data from {format_timestamp(timestamps.min)} to "
+          f"{format_timestamp(timestamps.max)} to the state file")
+
+def print_state(state: HistogramState, args: argparse.Namespace) -> None:
+    """ Print histograms of the data in `state` within the requested window. """
+    segments = state.window(args.since, args.until)
+    if not segments:
+        print("No data in the state file within the window")
+        return
+    histograms = new_histograms(name for (name, _)
+                                in HISTORY_METRICS + EVENT_METRICS)
+    for segment in segments:
+        merge_histograms(histograms, segment.histograms)
+    print(f"Data from {format_timestamp(min(s.start for s in segments))} to "
+          f"{format_timestamp(max(s.end for s in segments))} "
+          f"({len(segments)} of {len(state.segments)} updates)")
+    print("")
+    print_histograms(histograms)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Generate resource usage histograms from Hubble data. See "
+                    "the comments at the top of this file for sample Hubble "
+                    "queries to generate the appropriate data.")
+    parser.add_argument("history_transactions", nargs="?",
+                        help="CSV or Parquet file containing "
+                             "history_transactions data")
+    parser.add_argument("history_contract_events", nargs="?",
+                        help="CSV or Parquet file containing "
+                             "history_contract_events data")
+    parser.add_argument("--decoder", choices=DECODERS, default="native",
+                        help="how to decode transaction envelopes. Defaults "
+                             "to the in-process decoder.")
+    parser.add_argument("--compare-decoders", action="store_true",
+                        help="check that the in-process and streaming "
+                             "decoders match the stellar-xdr tool on "
+                             "history_transactions data, then exit")
+    parser.add_argument("--benchmark-decoders", action="store_true",
+                        help="print the throughput of each decoder on "
+                             "history_transactions data, then exit")
+    parser.add_argument("--benchmark-histogram", action="store_true",
+                        help="print the time taken to bin "
+                             f"{BENCHMARK_VALUES:,} random values from each "
+                             "of several distributions, then exit")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="number of worker processes. Defaults to "
+                             f"{WORKERS}.")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="SQLite file caching processed "
+                             "history_transactions rows by envelope. Rows "
+                             "already in the cache are not decoded again. "
+                             "Created if it does not exist.")
+    parser.add_argument("--state", metavar="PATH",
+                        help="JSON file of histograms from earlier runs. "
+                             "Input files, which must include a closed_at "
+                             "column, are added to it, and histograms are "
+                             "printed for the data in it. Input files may be "
+                             "omitted to only print.")
+    parser.add_argument("--since", type=parse_timestamp, metavar="TIME",
+                        help="with --state, only print data closed at or "
+                             "after TIME, such as 2024-06-24")
+    parser.add_argument("--until", type=parse_timestamp, metavar="TIME",
+                        help="with --state, only print data closed before "
+                             "TIME")
+    args = parser.parse_args()
+    if args.state is None and (args.since or args.until):
+        parser.error("--since and --until require --state")
+    if args.benchmark_histogram:
+        pass
+    elif args.compare_decoders or args.benchmark_decoders:
+        if args.history_transactions is None:
+            parser.error("history_transactions is required")
+    elif args.state is None or args.history_transactions is not None:
+        if args.history_contract_events is None:
+            parser.error("history_transactions and history_contract_events "
+                         "are required")
+    return args
 
 def main() -> None:
-    if len(sys.argv) != 3:
-        help_and_exit()
+    args = parse_args()
+
+    if args.compare_decoders:
+        sys.exit(0 if compare_decoders(args.history_transactions) else 1)
+    if args.benchmark_decoders:
+        benchmark_decoders(args.history_transactions)
+        sys.exit(0)
+    if args.benchmark_histogram:
+        benchmark_histogram()
+        sys.exit(0)
+
+    if args.state is not None:
+        try:
+            state = HistogramState.load(args.state)
+            if args.history_transactions is not None:
+                print("Processing data. This might take a few minutes...")
+                update_state(state, args)
+                state.save(args.state)
+                print("")
+        except ValueError as e:
+            sys.exit(f"Error: {e}")
+        print_state(state, args)
+        return
 
     print("Processing data. This might take a few minutes...")
 
-    process_soroban_history(sys.argv[1])
-    print("")
-    process_soroban_events(sys.argv[2])
+    histograms = process_soroban_history(args.history_transactions,
+                                         args.decoder, args.cache,
+                                         args.workers)
+    merge_histograms(histograms, process_soroban_events(
+        args.history_contract_events, args.workers))
+    print_histograms(histograms)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
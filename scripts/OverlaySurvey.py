@@ -66,15 +66,17 @@ import argparse
 from collections import defaultdict
 import json
 import logging
-import networkx as nx
 import random
-import requests
 import sys
 import time
 
-import overlay_survey.simulation as sim
+import overlay_survey.codec as codec
 import overlay_survey.util as util
 
+# networkx, numpy, requests, and the simulation module are slow to import, so
+# they are imported inside the functions that need them. This keeps `--help`
+# and subcommands that do not need them fast to start.
+
 logger = logging.getLogger(__name__)
 
 # A SurveySimulation, if running in simulation mode, or None otherwise.
@@ -106,10 +108,20 @@ def get_request(url, params=None):
     if SIMULATION:
         res = SIMULATION.get(url=url, params=params)
     else:
+        import requests
         res = requests.get(url=url, params=params)
     logger.debug("Received response: %s", res.text)
     return res
 
+def get_survey_result(url):
+    """
+    Fetch and decode survey results from the getsurveyresult endpoint at `url`.
+    """
+    res = get_request(url=url)
+    if SIMULATION:
+        return res.json()
+    return codec.decode_survey_result(res.content)
+
 def next_peer(direction_tag, node_info):
     if direction_tag in node_info and node_info[direction_tag]:
         for peer in node_info[direction_tag]:
@@ -156,6 +168,9 @@ def update_results(graph, parent_info, parent_key, results, is_inbound):
         edge_properties = peer.copy()
         edge_properties.pop("nodeId", None)
         edge_properties.pop("version", None)
+        # The metrics are the parent's view of the connection, and replace any
+        # the peer reported about it, so note whose they are
+        edge_properties["reportedBy"] = parent_key
         if is_inbound:
             graph.add_edge(other_key, parent_key, **edge_properties)
         else:
@@ -180,6 +195,8 @@ def send_survey_requests(peer_list, url_base, skip_sleep):
     Request survey data from a list of peers. `url_base` is the root HTTP
     endpoint to send requests to.
     """
+    import requests
+
     request_url = url_base + "/surveytopologytimesliced"
     logger.info("Requesting survey data from %s peers", len(peer_list))
     num_sent = 0
@@ -237,6 +254,8 @@ def check_results(data, graph, merged_results):
 
 
 def write_graph_stats(graph, output_file):
+    import networkx as nx
+
     try:
         stats = {}
         stats[
@@ -252,16 +271,48 @@ def write_graph_stats(graph, output_file):
 
 
 def analyze(args):
+    import networkx as nx
+
     graph = nx.read_graphml(args.graphmlAnalyze)
     if args.graphStats is not None:
         write_graph_stats(graph, args.graphStats)
     sys.exit(0)
 
 
+def edgestats(args):
+    import networkx as nx
+    import overlay_survey.edge_stats as edge_stats
+
+    graph = nx.read_graphml(args.graphmlInput)
+    stats = edge_stats.flood_stats(graph, args.top)
+    if stats["edgesWithoutReporter"]:
+        logger.warning("%i edges do not record which node reported them, as "
+                       "in graphs from older versions of this script. Their "
+                       "metrics count half towards each endpoint.",
+                       stats["edgesWithoutReporter"])
+
+    for key, label in [("versions", "version"),
+                       ("organizations", "organization")]:
+        for group in stats[key]:
+            logger.info("Duplicate/unique flood ratio for %s %s: %s",
+                        label, group["name"],
+                        group["duplicateToUniqueFloodRatio"])
+    for edge in stats["wastefulEdges"]:
+        logger.info("%s -> %s: %i duplicate bytes received (%s of bytes read)",
+                    edge["source"], edge["target"], edge["wastedBytes"],
+                    edge["wastedFractionOfBytesRead"])
+
+    if args.jsonOutput is not None:
+        codec.dump(stats, args.jsonOutput)
+    sys.exit(0)
+
+
 def get_tier1_stats(augmented_directed_graph):
     '''
     Helper function to help analyze transitive quorum. Must only be called on a graph augmented with StellarBeat info
     '''
+    import networkx as nx
+
     graph = augmented_directed_graph.to_undirected()
     tier1_nodes = [node for node, attr in graph.nodes(
         data=True) if 'isTier1' in attr and attr['isTier1'] == True]
@@ -291,6 +342,8 @@ def get_tier1_stats(augmented_directed_graph):
 
 
 def augment(args):
+    import networkx as nx
+
     graph = nx.read_graphml(args.graphmlInput)
     data = get_request("https://api.stellarbeat.io/v1/nodes").json()
     transitive_quorum = get_request(
@@ -314,7 +367,7 @@ def augment(args):
                     if val is None:
                         continue
                     if type(val) is dict:
-                        val = json.dumps(val)
+                        val = codec.dumps(val).decode("utf-8")
                     prop_dict['sb_{}'.format(prop)] = val
             graph.add_node(obj["publicKey"], **prop_dict)
 
@@ -384,7 +437,10 @@ def stop_survey_collecting(url, skip_sleep):
         time.sleep(sleep_time)
 
 def run_survey(args):
+    import networkx as nx
+
     if args.simulate:
+        import overlay_survey.simulation as sim
         global SIMULATION
         try:
             SIMULATION = sim.SurveySimulation(args.simGraph, args.simRoot)
@@ -477,7 +533,7 @@ def run_survey(args):
             time.sleep(BATCH_DURATION_SECONDS)
 
         logger.info("Fetching survey result")
-        data = get_request(url=survey_result).json()
+        data = get_survey_result(survey_result)
         logger.info("Done fetching result")
 
         if "topology" in data:
@@ -536,8 +592,7 @@ def run_survey(args):
 
     nx.write_graphml(graph, args.graphmlWrite)
 
-    with open(args.surveyResult, 'w') as outfile:
-        json.dump(merged_results, outfile)
+    codec.dump(merged_results, args.surveyResult)
 
     # sanity check that simulation produced a graph isomorphic to the input
     assert (not args.simulate or
@@ -554,6 +609,8 @@ def run_survey(args):
 
 
 def flatten(args):
+    import networkx as nx
+
     output_graph = []
     graph = nx.read_graphml(args.graphmlInput).to_undirected()
     for node, attr in graph.nodes(data=True):
@@ -561,12 +618,11 @@ def flatten(args):
             map(str, graph.adj[node]))}
         for key in attr:
             try:
-                new_attr[key] = json.loads(attr[key])
-            except (json.JSONDecodeError, TypeError):
+                new_attr[key] = codec.loads(attr[key])
+            except codec.DecodeError:
                 new_attr[key] = attr[key]
         output_graph.append(new_attr)
-    with open(args.jsonOutput, 'w') as output_file:
-        json.dump(output_graph, output_file)
+    codec.dump(output_graph, args.jsonOutput)
     sys.exit(0)
 
 def init_parser_survey(parser_survey):
@@ -647,6 +703,24 @@ def main():
                                 help="input graphml file")
     parser_analyze.set_defaults(func=analyze)
 
+    parser_edgestats = subparsers.add_parser('edgestats',
+                                             help="analyze flood efficiency "
+                                                  "of the graphml input graph")
+    parser_edgestats.add_argument("-gmli",
+                                  "--graphmlInput",
+                                  required=True,
+                                  help="input graphml file")
+    parser_edgestats.add_argument("-t",
+                                  "--top",
+                                  type=int,
+                                  default=20,
+                                  help="number of most wasteful edges to "
+                                       "report")
+    parser_edgestats.add_argument("-json",
+                                  "--jsonOutput",
+                                  help="output JSON file for edge stats")
+    parser_edgestats.set_defaults(func=edgestats)
+
     parser_augment = subparsers.add_parser('augment',
                                            help="augment the master graph "
                                                 "with stellarbeat data")
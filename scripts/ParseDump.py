@@ -1,6 +1,9 @@
 import argparse
 import re
 import subprocess
+import sys
+
+from parse_dump import crash_logs, symbol_index
 
 
 # input: ./src/stellar-core(+0xd9f6bd) [0x55ab4c2456bd]
@@ -17,6 +20,126 @@ def extract_relative_offset(line):
     return formated_offset[0][2:-1]
 
 
+def symbolize(exe, offsets):
+    """
+    Symbolize offsets into `exe` with a single addr2line process, which loads
+    the debug info once however many offsets there are. Offsets are fed over
+    stdin, so there is no limit on their number. Returns a dict from each
+    offset to its human readable location, "?? ??:0" if addr2line does not
+    know it.
+    """
+    unique_offsets = list(dict.fromkeys(offsets))
+    if not unique_offsets:
+        return {}
+
+    command = [
+        "addr2line",
+        "-f",  # Display function names
+        "-C",  # Demangle function names
+        "-p",  # Pretty print to human readable form
+        "-s",  # Only show file base names
+        "-e",
+        exe,
+    ]
+    result = subprocess.run(
+        command,
+        input="\n".join(unique_offsets) + "\n",
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+
+    # addr2line prints one line per offset, followed by one " (inlined by)"
+    # line per inlined call if asked for them
+    frames = []
+    for line in result.stdout.splitlines():
+        if line.startswith(" (inlined by)") and frames:
+            frames[-1] += "\n" + line
+        else:
+            frames.append(line)
+    if len(frames) != len(unique_offsets):
+        raise RuntimeError(
+            "addr2line returned {} locations for {} offsets".format(
+                len(frames), len(unique_offsets)
+            )
+        )
+    return dict(zip(unique_offsets, frames))
+
+
+def lookup(exe, offsets, args):
+    """
+    Symbolize offsets, from the symbol index if asked for and with addr2line
+    otherwise. Returns a dict from each offset to its location.
+    """
+    offsets = list(dict.fromkeys(offsets))
+    locations = {}
+    index = None
+    if args.index:
+        index = symbol_index.load_or_build(exe, args.cache_dir)
+        if index is None:
+            print(
+                "{} has no build ID to index it by, using addr2line".format(exe),
+                file=sys.stderr,
+            )
+        else:
+            for offset in offsets:
+                location = index.lookup(offset)
+                if location is not None:
+                    locations[offset] = location
+    resolved = symbolize(
+        exe, [offset for offset in offsets if offset not in locations]
+    )
+    if index is not None:
+        index.remember(resolved)
+    locations.update(resolved)
+    return locations
+
+
+def print_buckets(args):
+    """
+    Print the crash buckets of the stack traces in `args.logs`, largest
+    first, each with the symbolized stack of its first trace. Each distinct
+    offset is symbolized once.
+    """
+    traces = []
+    num_files = 0
+    for path, host in crash_logs.log_files(args.logs):
+        num_files += 1
+        traces.extend(crash_logs.read_traces(path, host))
+    buckets = crash_logs.bucket_traces(traces, args.frames)
+    offsets = [
+        offset
+        for bucket in buckets
+        for offset in crash_logs.core_offsets(bucket.traces[0])
+    ]
+    locations = lookup(args.exe.name, offsets, args)
+
+    print(
+        "{} stack traces in {} log files, {} crash buckets, {} distinct "
+        "stellar-core frames".format(
+            len(traces), num_files, len(buckets), len(locations)
+        )
+    )
+    for i, bucket in enumerate(buckets):
+        print()
+        print("## Bucket {}: {} stack traces".format(i + 1, len(bucket.traces)))
+        print("first seen {}, last seen {}".format(bucket.first_seen, bucket.last_seen))
+        print(
+            "hosts: {}".format(
+                ", ".join(
+                    "{} ({})".format(host, count)
+                    for host, count in bucket.hosts.most_common()
+                )
+            )
+        )
+        print("first found in {}".format(bucket.traces[0].path))
+        for module, location in bucket.traces[0].frames:
+            if "stellar-core" in module and location.startswith("+"):
+                print(locations[location[1:]])
+            else:
+                print("??")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Provide human readable stack trace for stellar-core traces."
@@ -30,30 +153,57 @@ def main():
 
     parser.add_argument(
         "stack_trace",
+        nargs="?",
         help="Stack trace reported by stellar-core (should start with something like: ./src/stellar-core(+0xd9f6bd) [0x55a1fcb7d6bd])",
     )
 
+    parser.add_argument(
+        "--logs",
+        nargs="+",
+        metavar="PATH",
+        help="Instead of a stack trace, scan these log files, and the files in "
+        "these directories, for stack traces, and print them grouped into crash "
+        "buckets",
+    )
+
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=crash_logs.DEFAULT_FRAMES,
+        help="Number of top stellar-core frames that must match for stack "
+        "traces to share a bucket (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Look up offsets in an index of the executable's symbols, built on "
+        "first use and cached by build ID, falling back to addr2line for inlined "
+        "code",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=symbol_index.DEFAULT_CACHE_DIR,
+        help="Directory of cached symbol indexes (default: %(default)s)",
+    )
+
     args = parser.parse_args()
+    if (args.stack_trace is None) == (args.logs is None):
+        parser.error("give either a stack trace or --logs")
+    if args.logs is not None:
+        print_buckets(args)
+        return
     stack_traces = args.stack_trace.split("\n")
 
-    addr2line_base_args = [
-        "addr2line",
-        "-f",  # Display function names
-        "-C",  # Demangle function names
-        "-p",  # Pretty print to human readable form
-        "-s",  # Only show file base names
-        "-e",
-        args.exe.name,
-    ]
+    relative_offsets = [extract_relative_offset(line) for line in stack_traces]
+    locations = lookup(args.exe.name, filter(None, relative_offsets), args)
 
-    for line in stack_traces:
-        relative_offset = extract_relative_offset(line)
+    for relative_offset in relative_offsets:
         if not relative_offset:
             print("??")
         else:
-            command = addr2line_base_args.copy()
-            command.append(relative_offset)
-            subprocess.run(command)
+            print(locations[relative_offset])
 
 
 if __name__ == "__main__":
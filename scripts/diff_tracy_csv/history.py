@@ -0,0 +1,167 @@
+"""
+This module keeps a history of per-zone aggregates by build in a SQLite
+database, so DiffTracyCSV.py can compare a build against a window of earlier
+builds rather than against a single snapshot.
+
+Statistics are stored in a table clustered by (build, zone), so the statistics
+of a window of consecutive builds are one range scan of its primary key, and
+reading a window costs the same at thousands of builds as at ten.
+"""
+
+import sqlite3
+import time
+
+import numpy as np
+
+# Bump when the schema changes. Older histories must be recreated.
+HISTORY_VERSION = 1
+
+# Statistics recorded for each zone of each build
+STATS = ["events", "sum", "median", "p90", "p99"]
+
+# Seconds to wait for another process's write to finish
+BUSY_TIMEOUT = 60
+
+
+class History:
+    """ Per-zone statistics of builds, in the order they were recorded. """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        with self._db:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                self._create()
+            elif version != HISTORY_VERSION:
+                raise ValueError("{} has unsupported version {}"
+                                 .format(path, version))
+
+    def _create(self):
+        self._db.execute("""CREATE TABLE builds (
+                                id INTEGER PRIMARY KEY,
+                                name TEXT NOT NULL UNIQUE,
+                                recorded_at INTEGER NOT NULL,
+                                runs INTEGER NOT NULL
+                            )""")
+        self._db.execute("""CREATE TABLE zones (
+                                id INTEGER PRIMARY KEY,
+                                name TEXT NOT NULL,
+                                src_file TEXT NOT NULL,
+                                src_line TEXT NOT NULL,
+                                UNIQUE (name, src_file, src_line)
+                            )""")
+        self._db.execute("""CREATE TABLE stats (
+                                build_id INTEGER NOT NULL,
+                                zone_id INTEGER NOT NULL,
+                                events REAL NOT NULL,
+                                sum REAL NOT NULL,
+                                median REAL,
+                                p90 REAL,
+                                p99 REAL,
+                                PRIMARY KEY (build_id, zone_id)
+                            ) WITHOUT ROWID""")
+        self._db.execute("PRAGMA user_version = {:d}"
+                         .format(HISTORY_VERSION))
+
+    def close(self):
+        self._db.close()
+
+    def record(self, build, runs, zones, replace=False):
+        """
+        Record the statistics of a build, given as a dict from zone key to a
+        tuple of STATS values. Raises ValueError if the build was already
+        recorded, unless `replace` is set, in which case its statistics are
+        replaced and it keeps its place in the history.
+        """
+        with self._db:
+            found = self._db.execute("SELECT id FROM builds WHERE name = ?",
+                                     (build,)).fetchone()
+            if found is not None and not replace:
+                raise ValueError("build {} is already recorded"
+                                 .format(build))
+            if found is None:
+                build_id = self._db.execute(
+                    "INSERT INTO builds (name, recorded_at, runs) "
+                    "VALUES (?, ?, ?)",
+                    (build, int(time.time()), runs)).lastrowid
+            else:
+                build_id = found[0]
+                self._db.execute(
+                    "UPDATE builds SET recorded_at = ?, runs = ? WHERE id = ?",
+                    (int(time.time()), runs, build_id))
+                self._db.execute("DELETE FROM stats WHERE build_id = ?",
+                                 (build_id,))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO zones (name, src_file, src_line) "
+                "VALUES (?, ?, ?)", zones.keys())
+            zone_ids = self._zone_ids()
+            self._db.executemany(
+                "INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((build_id, zone_ids[key], *values)
+                 for key, values in zones.items()))
+
+    def _zone_ids(self):
+        return {(name, src_file, src_line): zone_id
+                for zone_id, name, src_file, src_line in self._db.execute(
+                    "SELECT id, name, src_file, src_line FROM zones")}
+
+    def builds(self):
+        """ Names of the recorded builds, oldest first. """
+        return [name for (name,) in self._db.execute(
+            "SELECT name FROM builds ORDER BY id")]
+
+    def window(self, build=None, size=10):
+        """
+        Return the name of `build` (by default the latest build) and the
+        names of up to `size` builds recorded before it, oldest first.
+        Raises ValueError if there is no such build.
+        """
+        if build is None:
+            found = self._db.execute(
+                "SELECT id, name FROM builds ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        else:
+            found = self._db.execute(
+                "SELECT id, name FROM builds WHERE name = ?",
+                (build,)).fetchone()
+        if found is None:
+            raise ValueError("the history has no builds" if build is None
+                             else "no build {} in the history".format(build))
+        build_id, build = found
+        baseline = [name for (name,) in self._db.execute(
+            "SELECT name FROM builds WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (build_id, size))]
+        return build, baseline[::-1]
+
+    def stats(self, builds):
+        """
+        Return the keys of every zone recorded for any of `builds`, and an
+        array of shape (zones, builds, STATS) of their statistics, with NaN
+        where a zone was not recorded for a build or a quantile is missing.
+        """
+        ids = dict()
+        for name in builds:
+            (ids[name],) = self._db.execute(
+                "SELECT id FROM builds WHERE name = ?", (name,)).fetchone()
+        if not ids:
+            return [], np.zeros((0, 0, len(STATS)))
+        column = {build_id: i for i, build_id in enumerate(ids.values())}
+        # One range scan of the primary key, keeping only the builds asked for
+        rows = self._db.execute(
+            "SELECT build_id, zone_id, {} FROM stats "
+            "WHERE build_id BETWEEN ? AND ?".format(", ".join(STATS)),
+            (min(ids.values()), max(ids.values()))).fetchall()
+        rows = [row for row in rows if row[0] in column]
+        zone_ids = sorted({row[1] for row in rows})
+        row_index = {zone_id: i for i, zone_id in enumerate(zone_ids)}
+        keys_by_id = {zone_id: key
+                      for key, zone_id in self._zone_ids().items()}
+
+        values = np.full((len(zone_ids), len(ids), len(STATS)), np.nan)
+        if rows:
+            values[[row_index[row[1]] for row in rows],
+                   [column[row[0]] for row in rows]] = np.array(
+                       [row[2:] for row in rows], dtype=np.float64)
+        return [keys_by_id[zone_id] for zone_id in zone_ids], values
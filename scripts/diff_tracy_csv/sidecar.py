@@ -0,0 +1,131 @@
+"""
+This module caches the per-zone aggregates DiffTracyCSV.py computes from an
+export in sidecar files next to it, so comparing against the same export again
+skips parsing it.
+
+A sidecar is a pair of files named after the export and the aggregation mode:
+`<export>.<mode>.npz` holds the zone table and statistics, and
+`<export>.<mode>.npy` holds every zone's sorted times (or sketch items), which
+are memory-mapped rather than read. The `.npz` file is written last and records
+the size, modification time and a hash of the export it was computed from, so a
+sidecar is only used while the export is unchanged. The hash covers the first
+and last HASH_SAMPLE_SIZE bytes, which catches an export rewritten with the
+same size and time without reading all of it.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from diff_tracy_csv.significance import Distribution
+
+# Bump when the sidecar format changes, to ignore old sidecars
+SIDECAR_VERSION = 2
+
+# Number of bytes hashed at each end of an export
+HASH_SAMPLE_SIZE = 1 << 20
+
+# Per-zone statistics stored in a sidecar, in the order `read_file` uses.
+# Missing values are stored as NaN.
+STATS = ["events", "sums", "medians", "p90s", "p99s", "rank_errors"]
+
+
+def sidecar_paths(filename, sketch_k):
+    mode = "exact" if sketch_k is None else "kll{:d}".format(sketch_k)
+    base = "{}.{}".format(filename, mode)
+    return base + ".npz", base + ".npy"
+
+
+def fingerprint(filename):
+    """ Size, modification time and hash of the file `filename`. """
+    with open(filename, "rb") as f:
+        st = os.fstat(f.fileno())
+        digest = hashlib.blake2b(f.read(HASH_SAMPLE_SIZE), digest_size=16)
+        if st.st_size > HASH_SAMPLE_SIZE:
+            f.seek(max(HASH_SAMPLE_SIZE, st.st_size - HASH_SAMPLE_SIZE))
+            digest.update(f.read())
+    return st.st_size, st.st_mtime_ns, digest.hexdigest()
+
+
+def load(filename, sketch_k, export_fingerprint):
+    """
+    Load the sidecar of `filename` for the given mode. Returns the number of
+    rows, the zone keys and the lists of `read_file` statistics, or None if
+    there is no sidecar valid for the export's current `fingerprint`.
+    """
+    meta_path, values_path = sidecar_paths(filename, sketch_k)
+    try:
+        with np.load(meta_path, allow_pickle=False) as meta:
+            if (int(meta["version"]) != SIDECAR_VERSION or
+                    tuple(meta["fingerprint"].tolist()) !=
+                    tuple(str(v) for v in export_fingerprint)):
+                return None
+            meta = dict(meta)
+        values = np.load(values_path, mmap_mode="r")
+    except (OSError, KeyError, ValueError):
+        return None
+    starts = meta["starts"]
+    lengths = meta["lengths"]
+    if len(values) != lengths.sum():
+        return None
+
+    keys = list(zip(*(meta[column].tolist()
+                      for column in ("names", "src_files", "src_lines"))))
+    stats = [[None if v != v else v for v in meta[name].tolist()]
+             for name in STATS]
+    stats[0] = [int(v) for v in stats[0]]
+    # Zones without a distribution have length 0
+    weights = meta.get("cumulative_weights")
+    distributions = []
+    for start, length in zip(starts.tolist(), lengths.tolist()):
+        if length == 0:
+            distributions.append(None)
+        else:
+            zone_weights = (None if weights is None or weights[start] == 0
+                            else weights[start:start + length])
+            distributions.append(Distribution(values[start:start + length],
+                                              zone_weights))
+    return int(meta["rows"]), keys, stats + [distributions]
+
+
+def _replace(path, write):
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save(filename, sketch_k, export_fingerprint, rows, keys, stats):
+    """
+    Write the sidecar of `filename` for the given mode, from the values
+    `load` returns. `export_fingerprint` must be taken before the export is
+    read, so that changes made while reading invalidate the sidecar. Each file
+    is replaced atomically.
+    """
+    meta_path, values_path = sidecar_paths(filename, sketch_k)
+    *columns, distributions = stats
+    lengths = np.array([0 if d is None else len(d.values)
+                        for d in distributions], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    present = [d for d in distributions if d is not None]
+    meta = {"version": SIDECAR_VERSION,
+            "fingerprint": np.array([str(v) for v in export_fingerprint]),
+            "rows": rows,
+            "starts": starts,
+            "lengths": lengths}
+    for i, column in enumerate(("names", "src_files", "src_lines")):
+        meta[column] = np.array([key[i] for key in keys], dtype=np.str_)
+    for name, column in zip(STATS, columns):
+        meta[name] = np.array([np.nan if v is None else v for v in column],
+                              dtype=np.float64)
+    if sketch_k is not None:
+        # Exact zones are marked by a weight of 0 at their start
+        meta["cumulative_weights"] = np.concatenate(
+            [np.zeros(len(d.values), dtype=np.int64)
+             if d.cumulative_weights is None else d.cumulative_weights
+             for d in present] + [np.zeros(0, dtype=np.int64)])
+
+    _replace(values_path, lambda f: np.save(f, np.concatenate(
+        [d.values for d in present] + [np.zeros(0)])))
+    _replace(meta_path, lambda f: np.savez(f, **meta))
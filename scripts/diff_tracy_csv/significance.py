@@ -0,0 +1,94 @@
+"""
+This module provides bootstrap confidence intervals for the change in a zone's
+timings between two sets of runs, used by DiffTracyCSV.py to flag only changes
+that exceed run-to-run noise.
+
+The bootstrap is hierarchical: each resample draws runs with replacement from
+each set, then resamples the events of each drawn run. A statistic of a set is
+the mean over its runs of the per-run statistic (median, p90, sum or number of
+events), and the interval is the percentile interval of the difference between
+the new and old statistics across resamples.
+
+Resampling events is never done explicitly. Resampling n sorted values with
+replacement picks the indices floor(n * U) for n uniform U, and floor is
+monotone, so the r-th smallest resampled value is the value at index
+floor(n * U_(r)), where U_(r), the r-th smallest of n uniforms, follows a
+Beta(r, n - r + 1) distribution. A resampled quantile thus costs one beta draw
+whatever the number of events, and every resample of every run is drawn in one
+vectorized call. Resampled quantiles use the nearest-rank definition, with
+r = ceil(q * n).
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# Default number of bootstrap resamples
+DEFAULT_RESAMPLES = 2000
+
+# Default confidence of the intervals. Hundreds of zones are tested at once, so
+# this is higher than the usual 95% to keep false flags rare.
+DEFAULT_CONFIDENCE = 0.99
+
+# The times of a zone in one run, in ascending order. `cumulative_weights` is
+# None if every value stands for one event, and otherwise holds the running
+# total of the number of events each value stands for, as for a sketch.
+Distribution = namedtuple("Distribution", ["values", "cumulative_weights"])
+
+
+def resample_runs(num_runs, resamples, rng):
+    """
+    Draw `resamples` sets of `num_runs` run indices with replacement, as an
+    array of shape (resamples, num_runs).
+    """
+    return rng.integers(num_runs, size=(resamples, num_runs))
+
+
+def resample_means(values, runs):
+    """ Mean of the per-run `values` over each set of resampled `runs`. """
+    return np.asarray(values, dtype=np.float64)[runs].mean(axis=1)
+
+
+def resample_quantiles(distributions, q, runs, rng):
+    """
+    Resample the events of each run in each set of resampled `runs`, and
+    return the mean over each set of the q-quantile of the resampled events.
+    """
+    sizes = np.array([len(d.values) if d.cumulative_weights is None
+                      else int(d.cumulative_weights[-1])
+                      for d in distributions], dtype=np.int64)
+    offsets = np.cumsum(sizes) - sizes
+    values = np.concatenate([d.values for d in distributions])
+
+    n = sizes[runs]
+    rank = np.maximum(np.ceil(q * n), 1)
+    position = np.minimum((rng.beta(rank, n - rank + 1) * n).astype(np.int64),
+                          n - 1) + offsets[runs]
+    if all(d.cumulative_weights is None for d in distributions):
+        index = position
+    else:
+        # Find the value whose weight covers each position, with every run's
+        # weights shifted past the runs before it
+        cumulative_weights = np.concatenate(
+            [np.arange(1, len(d.values) + 1) if d.cumulative_weights is None
+             else d.cumulative_weights
+             for d in distributions]) + np.repeat(
+                 offsets, [len(d.values) for d in distributions])
+        index = np.searchsorted(cumulative_weights, position, side="right")
+    return values[index].mean(axis=1)
+
+
+def interval(old, new, confidence):
+    """
+    Percentile interval, at the given confidence, of the difference between
+    resampled `new` and `old` statistics.
+    """
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(new - old, [tail, 1 - tail])
+    return float(low), float(high)
+
+
+def is_significant(ci):
+    """ True if the interval `ci` excludes zero. """
+    low, high = ci
+    return low > 0 or high < 0
@@ -0,0 +1,120 @@
+"""
+This module provides a KLL quantile sketch (Karnin, Lang and Liberty,
+"Optimal Quantile Approximation in Streams", 2016), used by DiffTracyCSV.py to
+estimate zone timing quantiles in memory that does not grow with the number of
+events.
+
+A sketch keeps a stack of sorted buffers ("compactors"). Items in level h stand
+for 2**h input values. When a level exceeds its capacity it is compacted: its
+items are sorted and every other one, starting at a random offset, moves up a
+level. The top level holds up to k items, and each level below holds 2/3 as
+many (but at least 2), so a sketch holds fewer than 3k + 2 * levels items.
+
+Rank error: a compaction at level h changes the rank of any value by 0 or by
++/-2**h, each sign being equally likely. By the Azuma-Hoeffding inequality, the
+rank of any single value is then off by at most
+
+    sqrt(2 * ln(2 / delta) * sum(4**h for each compaction at level h))
+
+with probability at least 1 - delta. `rank_error` reports this bound as a
+fraction of the number of values, from the compactions that actually happened.
+A level of capacity c is compacted fewer than n / (c * 2**h) times, and the
+capacities make the top levels dominate the sum, which comes to about
+12 * n**2 / k**2. The normalized bound is then about 4.9 * sqrt(ln(2 / delta))
+/ k, or 11 / k at 99% confidence. In practice it is several times smaller.
+"""
+
+import math
+
+import numpy as np
+
+# Default capacity of the top level
+DEFAULT_K = 512
+
+# Smallest capacity of any level
+MIN_CAPACITY = 2
+
+# Ratio of the capacity of a level to the capacity of the level above it
+CAPACITY_DECAY = 2 / 3
+
+
+class KllSketch:
+    """A KLL sketch over float values."""
+
+    def __init__(self, k=DEFAULT_K, rng=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        # Sum of the squared weights of all compactions
+        self.variance = 0
+        self._rng = rng if rng is not None else np.random.default_rng()
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(MIN_CAPACITY, int(self.k * CAPACITY_DECAY ** depth))
+
+    def update(self, values):
+        """Add an array of values to the sketch."""
+        self.n += len(values)
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            grow = level + 1 == len(self.levels)
+            if grow:
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # An odd item out stays behind
+            odd = len(items) % 2
+            offset = self._rng.integers(2)
+            self.levels[level + 1] = np.concatenate(
+                (self.levels[level + 1], items[offset:len(items) - odd:2]))
+            self.levels[level] = items[len(items) - odd:]
+            self.variance += 4 ** level
+            if grow:
+                # Adding a level lowered the capacity of every level below
+                # it, so check them all again
+                level = 0
+
+    def is_exact(self):
+        """True if no values have been compacted, so the sketch holds all of
+        them."""
+        return self.variance == 0
+
+    def sorted_values_and_weights(self):
+        """Return every item in the sketch in ascending order, along with its
+        weight."""
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 1 << level)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    def quantile(self, q):
+        """
+        Estimate the value with rank q * n, that is, the smallest item whose
+        cumulative weight is at least q * n.
+        """
+        values, weights = self.sorted_values_and_weights()
+        index = np.searchsorted(np.cumsum(weights), q * self.n)
+        return float(values[min(index, len(values) - 1)])
+
+    def rank_error(self, delta=0.01):
+        """
+        Bound on the error in the rank of a value, as a fraction of the number
+        of values, that holds with probability at least 1 - delta.
+        """
+        if self.n == 0:
+            return 0.0
+        return math.sqrt(2 * math.log(2 / delta) * self.variance) / self.n
+
+    def size(self):
+        """Number of items held."""
+        return sum(len(items) for items in self.levels)
+
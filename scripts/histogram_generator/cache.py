@@ -0,0 +1,88 @@
+# Copyright 2024 Stellar Development Foundation and contributors. Licensed
+# under the Apache License, Version 2.0. See the COPYING file at the root
+# of this distribution or at http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+An on-disk cache of processed history_transactions rows, keyed by a hash of
+the row's base64 encoded envelope. Reruns over overlapping date ranges look up
+rows they have already seen instead of decoding their envelopes again.
+
+The cache is a SQLite database in WAL mode, so every worker process opens its
+own connection and reads proceed while another worker writes.
+"""
+
+import hashlib
+import sqlite3
+from typing import Iterable, Optional, Tuple
+
+# Result of processing a row, as returned by
+# HistogramGenerator.process_history_row
+ProcessedRow = Tuple[Optional[Tuple[int, int, int]], Optional[int]]
+
+# Bump when the meaning of a cached row changes, to discard stale entries
+CACHE_VERSION = 1
+
+# Seconds to wait for another worker's write to finish
+BUSY_TIMEOUT = 60
+
+
+def envelope_key(envelope_xdr: str) -> bytes:
+    """ Cache key of a base64 encoded envelope. """
+    return hashlib.blake2b(envelope_xdr.encode("ascii"),
+                           digest_size=16).digest()
+
+
+class EnvelopeCache:
+    """
+    Maps envelope keys to processed rows. The resource columns of a row are
+    declared in its envelope, so the envelope alone determines the result.
+    """
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        with self._db:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version != CACHE_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS rows")
+                self._db.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+            # A row with no values is not an invoke or a wasm upload
+            self._db.execute("""CREATE TABLE IF NOT EXISTS rows (
+                                    key BLOB PRIMARY KEY,
+                                    instructions INTEGER,
+                                    write_bytes INTEGER,
+                                    tx_size INTEGER,
+                                    wasm_size INTEGER
+                                ) WITHOUT ROWID""")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def lookup(self, keys: list[bytes]) -> dict[bytes, ProcessedRow]:
+        """ Return the cached result for each key in `keys` that has one. """
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        cursor = self._db.execute(
+            "SELECT key, instructions, write_bytes, tx_size, wasm_size "
+            f"FROM rows WHERE key IN ({placeholders})", keys)
+        found = {}
+        for key, instructions, write_bytes, tx_size, wasm_size in cursor:
+            if wasm_size is not None:
+                found[key] = (None, wasm_size)
+            elif instructions is not None:
+                found[key] = ((instructions, write_bytes, tx_size), None)
+            else:
+                found[key] = (None, None)
+        return found
+
+    def store(self, rows: Iterable[Tuple[bytes, ProcessedRow]]) -> None:
+        """ Add `(key, result)` pairs to the cache in one transaction. """
+        values = []
+        for key, (invoke, wasm_size) in rows:
+            instructions, write_bytes, tx_size = invoke or (None, None, None)
+            values.append((key, instructions, write_bytes, tx_size,
+                           wasm_size))
+        with self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO rows VALUES (?, ?, ?, ?, ?)", values)
@@ -0,0 +1,124 @@
+# Copyright 2024 Stellar Development Foundation and contributors. Licensed
+# under the Apache License, Version 2.0. See the COPYING file at the root
+# of this distribution or at http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Fixed-precision log-linear (HDR-style) histograms over non-negative integers.
+Memory use is fixed regardless of how many values are recorded, and histograms
+built by different workers merge by adding their bucket counts.
+"""
+
+from typing import Any, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+# Values below 2**SIGNIFICANT_BITS are counted exactly. Larger values share a
+# bucket with values within a relative error of 2**-(SIGNIFICANT_BITS - 1).
+SIGNIFICANT_BITS = 12
+
+# Largest bit length of a recordable value. Values are converted to float64 to
+# find their bucket, which is exact below 2**53.
+MAX_VALUE_BITS = 53
+
+
+class LogLinearHistogram:
+    """
+    Counts values in buckets of width 1 below 2**SIGNIFICANT_BITS, and in
+    2**(SIGNIFICANT_BITS - 1) equal-width buckets per power of two above that.
+    Also tracks the exact minimum and maximum values recorded.
+    """
+    def __init__(self, significant_bits: int = SIGNIFICANT_BITS):
+        self.significant_bits = significant_bits
+        half = 1 << (significant_bits - 1)
+        self.counts = np.zeros((1 << significant_bits) +
+                               (MAX_VALUE_BITS - significant_bits) * half,
+                               dtype=np.int64)
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def __getstate__(self):
+        # Most buckets are empty, so only pickle the nonzero ones when sending
+        # histograms between processes
+        nonzero = np.flatnonzero(self.counts)
+        return (self.significant_bits, self.min, self.max, nonzero,
+                self.counts[nonzero])
+
+    def __setstate__(self, state):
+        significant_bits, min_, max_, nonzero, counts = state
+        self.__init__(significant_bits)
+        self.min = min_
+        self.max = max_
+        self.counts[nonzero] = counts
+
+    def to_json(self) -> dict[str, Any]:
+        """ A JSON-serializable form of this histogram. """
+        buckets = np.flatnonzero(self.counts)
+        return {"significant_bits": self.significant_bits,
+                "min": self.min,
+                "max": self.max,
+                "buckets": buckets.tolist(),
+                "counts": self.counts[buckets].tolist()}
+
+    @classmethod
+    def from_json(cls, obj: dict[str, Any]) -> "LogLinearHistogram":
+        """ Inverse of `to_json`. """
+        histogram = cls.__new__(cls)
+        histogram.__setstate__((obj["significant_bits"], obj["min"],
+                                obj["max"], obj["buckets"], obj["counts"]))
+        return histogram
+
+    def total(self) -> int:
+        """ Number of values recorded. """
+        return int(self.counts.sum())
+
+    def _indices(self, values: np.ndarray) -> np.ndarray:
+        """ Bucket index of each value in `values`. """
+        bits = self.significant_bits
+        # frexp gives each value's bit length as its exponent
+        _, bit_length = np.frexp(values.astype(np.float64))
+        shift = np.maximum(bit_length - bits, 0)
+        mantissa = values >> shift
+        # Values with shift 0 are their own index. Each shift above that adds
+        # a run of 2**(bits - 1) buckets for mantissas in [2**(bits - 1),
+        # 2**bits).
+        return np.where(shift == 0, values,
+                        mantissa + (shift << (bits - 1)))
+
+    def record(self, values: npt.ArrayLike) -> None:
+        """ Record each value in `values`. """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size == 0:
+            return
+        low = int(values.min())
+        high = int(values.max())
+        if low < 0 or high >= 1 << MAX_VALUE_BITS:
+            raise ValueError(f"values must be in [0, 2**{MAX_VALUE_BITS})")
+        self.counts += np.bincount(self._indices(values),
+                                   minlength=len(self.counts))
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other: "LogLinearHistogram") -> None:
+        """ Add the values recorded in `other` to this histogram. """
+        assert self.significant_bits == other.significant_bits
+        self.counts += other.counts
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def values_and_weights(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return a representative value and a count for each nonzero bucket. The
+        representative value is exact for buckets of width 1, and the bucket's
+        midpoint (clamped to the recorded range) otherwise.
+        """
+        bits = self.significant_bits
+        index = np.flatnonzero(self.counts)
+        shift = np.maximum((index >> (bits - 1)) - 1, 0)
+        mantissa = np.where(shift == 0, index, index - (shift << (bits - 1)))
+        low = mantissa << shift
+        midpoint = low + ((1 << shift) - 1) / 2
+        values = np.clip(midpoint, self.min, self.max)
+        return values, self.counts[index]
@@ -0,0 +1,197 @@
+# Copyright 2024 Stellar Development Foundation and contributors. Licensed
+# under the Apache License, Version 2.0. See the COPYING file at the root
+# of this distribution or at http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Chunked, column-projected loading of Hubble exports. CSV files are read with
+pyarrow when it is installed and with the `csv` module otherwise. Parquet files
+(as produced by BigQuery exports) require pyarrow.
+
+Files can also be split into shards that worker processes read independently,
+so that the parent process does not parse every row itself.
+"""
+
+from collections import namedtuple
+import csv
+import io
+from itertools import islice
+import math
+import mmap
+import os
+from typing import Iterator
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+# A batch of rows, as a dict from column name to the values of that column
+Batch = dict[str, list]
+
+# Size in bytes of each block pyarrow reads from a CSV file
+CSV_BLOCK_SIZE = 16 << 20
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+# Target size in bytes of a CSV shard. Workers hold a whole shard in memory.
+SHARD_SIZE = 32 << 20
+
+# Size in bytes of each block scanned for quotes when finding shard boundaries
+SCAN_BLOCK_SIZE = 4 << 20
+
+# A part of a file that can be read independently. For CSV files `start` and
+# `end` are byte offsets of record boundaries, and for Parquet files they are
+# row group indices.
+Shard = namedtuple("Shard", ["path", "start", "end"])
+
+
+def is_parquet(path: str) -> bool:
+    return path.lower().endswith(PARQUET_EXTENSIONS)
+
+
+def _arrow_batches(batches, batch_size: int) -> Iterator[Batch]:
+    """ Split pyarrow RecordBatches into Batches of at most `batch_size`. """
+    for record_batch in batches:
+        for start in range(0, record_batch.num_rows, batch_size):
+            yield record_batch.slice(start, batch_size).to_pydict()
+
+
+def _read_csv_arrow(source, columns: list[str],
+                    batch_size: int) -> Iterator[Batch]:
+    # Read every column as a string, so values match what the csv module
+    # would produce. Quoted values (such as data_decoded JSON) may contain
+    # newlines.
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={column: pa.string() for column in columns}))
+    yield from _arrow_batches(reader, batch_size)
+
+
+def _read_csv(f: io.TextIOBase, columns: list[str],
+              batch_size: int) -> Iterator[Batch]:
+    reader = csv.reader(f)
+    header = next(reader)
+    try:
+        indices = [header.index(column) for column in columns]
+    except ValueError as e:
+        raise KeyError(f"missing a required column: {e}")
+    while rows := list(islice(reader, batch_size)):
+        yield {column: [row[i] for row in rows]
+               for column, i in zip(columns, indices)}
+
+
+def read_batches(path: str, columns: list[str],
+                 batch_size: int) -> Iterator[Batch]:
+    """
+    Read `columns` from the CSV or Parquet file at `path`, in batches of at
+    most `batch_size` rows. Other columns are never converted to Python
+    objects.
+    """
+    if is_parquet(path):
+        if pa is None:
+            raise RuntimeError("Reading Parquet files requires pyarrow")
+        parquet = pa_parquet.ParquetFile(path)
+        yield from _arrow_batches(
+            parquet.iter_batches(batch_size=batch_size, columns=columns),
+            batch_size)
+    elif pa is not None:
+        yield from _read_csv_arrow(path, columns, batch_size)
+    else:
+        with open(path, newline="") as f:
+            yield from _read_csv(f, columns, batch_size)
+
+
+def _count_quotes(data: mmap.mmap, start: int, end: int) -> int:
+    return sum(data[pos:min(pos + SCAN_BLOCK_SIZE, end)].count(b'"')
+               for pos in range(start, end, SCAN_BLOCK_SIZE))
+
+
+def _next_record(data: mmap.mmap, pos: int, in_quotes: bool) -> int:
+    """
+    Find the first record boundary at or after `pos`, given whether `pos` is
+    inside a quoted field. A newline ends a record only if it is outside
+    quotes, and since an escaped quote is written as two quotes, a position is
+    inside quotes exactly when an odd number of quotes precede it in its
+    record.
+    """
+    while True:
+        newline = data.find(b"\n", pos)
+        if newline == -1:
+            return len(data)
+        in_quotes ^= _count_quotes(data, pos, newline) % 2 == 1
+        pos = newline + 1
+        if not in_quotes:
+            return pos
+
+
+def _csv_shards(path: str, num_shards: int) -> list[Shard]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = _next_record(data, 0, False)
+            size = len(data) - header_end
+            shards = []
+            start = header_end
+            # Scan forward from each boundary to the next target offset, so
+            # the file is scanned for quotes once in total
+            for i in range(1, num_shards + 1):
+                target = header_end + size * i // num_shards
+                if target <= start:
+                    continue
+                in_quotes = _count_quotes(data, start, target) % 2 == 1
+                end = _next_record(data, target, in_quotes)
+                shards.append(Shard(path, start, end))
+                start = end
+                if end == len(data):
+                    break
+            return shards
+
+
+def shards(path: str, min_shards: int) -> list[Shard]:
+    """
+    Split the CSV or Parquet file at `path` into at least `min_shards` shards
+    (if it is large enough), each of at most about SHARD_SIZE bytes for CSV
+    files. Finding CSV record boundaries scans the file for quotes, which is
+    much faster than parsing it.
+    """
+    if is_parquet(path):
+        if pa is None:
+            raise RuntimeError("Reading Parquet files requires pyarrow")
+        num_row_groups = pa_parquet.ParquetFile(path).num_row_groups
+        return [Shard(path, i, i + 1) for i in range(num_row_groups)]
+    num_shards = max(min_shards,
+                     math.ceil(os.path.getsize(path) / SHARD_SIZE))
+    return _csv_shards(path, num_shards)
+
+
+def read_shard(shard: Shard, columns: list[str],
+               batch_size: int) -> Iterator[Batch]:
+    """ Like `read_batches`, but reads only the rows in `shard`. """
+    if is_parquet(shard.path):
+        parquet = pa_parquet.ParquetFile(shard.path)
+        yield from _arrow_batches(
+            parquet.iter_batches(batch_size=batch_size, columns=columns,
+                                 row_groups=range(shard.start, shard.end)),
+            batch_size)
+        return
+    with open(shard.path, "rb") as f:
+        # Every shard is parsed with the file's header, so it reads the same
+        # columns as a parse of the whole file
+        header = f.readline()
+        while header.count(b'"') % 2 == 1:
+            header += f.readline()
+        f.seek(shard.start)
+        data = header + f.read(shard.end - shard.start)
+    if pa is not None:
+        yield from _read_csv_arrow(io.BytesIO(data), columns, batch_size)
+    else:
+        text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8",
+                                newline="")
+        yield from _read_csv(text, columns, batch_size)
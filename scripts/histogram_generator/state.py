@@ -0,0 +1,108 @@
+# Copyright 2024 Stellar Development Foundation and contributors. Licensed
+# under the Apache License, Version 2.0. See the COPYING file at the root
+# of this distribution or at http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+Persisted histogram state, so that new data can be added to earlier results
+without reprocessing the exports they came from. The state is a list of
+segments, one per update, each holding the histograms of the rows it was built
+from and the range of their `closed_at` times. Histograms for a window are the
+merge of the segments inside it.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timezone
+import json
+import os
+from typing import Any, Iterable, Optional
+
+from histogram_generator.histogram import LogLinearHistogram
+
+# Bump when the state file format changes
+STATE_VERSION = 1
+
+# Histograms of a set of rows, along with the first and last `closed_at` times
+# of those rows as Unix timestamps
+Segment = namedtuple("Segment", ["start", "end", "histograms"])
+
+
+def parse_timestamp(value: Any) -> datetime:
+    """
+    Parse a `closed_at` value, either a datetime read from Parquet or a string
+    such as "2024-06-24 00:00:05 UTC" read from CSV. Times without a time zone
+    are taken to be UTC.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.removesuffix(" UTC"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def to_unix_timestamps(values: Iterable[Any]) -> list[int]:
+    """ Convert `closed_at` values to Unix timestamps. """
+    return [int(parse_timestamp(value).timestamp()) for value in values]
+
+
+def format_timestamp(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class HistogramState:
+    """ Segments of mergeable histograms, in the order they were added. """
+    def __init__(self, segments: Optional[list[Segment]] = None):
+        self.segments = segments or []
+
+    @classmethod
+    def load(cls, path: str) -> "HistogramState":
+        """ Load the state at `path`, or an empty state if it does not exist. """
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            obj = json.load(f)
+        if obj["version"] != STATE_VERSION:
+            raise ValueError(f"{path} has unsupported version "
+                             f"{obj['version']}")
+        return cls([Segment(segment["start"], segment["end"],
+                            {name: LogLinearHistogram.from_json(histogram)
+                             for name, histogram
+                             in segment["histograms"].items()})
+                    for segment in obj["segments"]])
+
+    def save(self, path: str) -> None:
+        """
+        Write the state to `path`. The file is replaced atomically, so an
+        interrupted save leaves the previous state intact.
+        """
+        obj = {"version": STATE_VERSION,
+               "segments": [{"start": segment.start,
+                             "end": segment.end,
+                             "histograms": {name: histogram.to_json()
+                                            for name, histogram
+                                            in segment.histograms.items()}}
+                            for segment in self.segments]}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+
+    def add(self, segment: Segment) -> None:
+        """
+        Add a segment. Raises ValueError if its time range overlaps an
+        existing segment, since its rows would then likely be counted twice.
+        """
+        for other in self.segments:
+            if segment.start <= other.end and other.start <= segment.end:
+                raise ValueError(
+                    f"data from {format_timestamp(segment.start)} to "
+                    f"{format_timestamp(segment.end)} overlaps data already "
+                    f"in the state, from {format_timestamp(other.start)} to "
+                    f"{format_timestamp(other.end)}")
+        self.segments.append(segment)
+
+    def window(self, since: Optional[datetime] = None,
+               until: Optional[datetime] = None) -> list[Segment]:
+        """ Return the segments entirely within [since, until). """
+        return [segment for segment in self.segments
+                if (since is None or segment.start >= since.timestamp()) and
+                   (until is None or segment.end < until.timestamp())]
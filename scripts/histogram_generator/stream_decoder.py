@@ -0,0 +1,94 @@
+# Copyright 2024 Stellar Development Foundation and contributors. Licensed
+# under the Apache License, Version 2.0. See the COPYING file at the root
+# of this distribution or at http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+A long-lived `stellar-xdr` process that decodes a stream of
+TransactionEnvelopes, so that decoding does not pay process startup per
+envelope.
+"""
+
+from base64 import b64decode
+import json
+import subprocess
+import threading
+from typing import Any, Callable
+
+# Decode a stream of concatenated binary TransactionEnvelopes. XDR values are
+# self-delimiting, so no framing is needed, and stellar-xdr prints each decoded
+# value as a single line of JSON as soon as it has been read.
+STREAM_DECODE_CMD = ["stellar-xdr", "decode",
+                     "--type", "TransactionEnvelope",
+                     "--input", "stream",
+                     "--output", "json"]
+
+
+def _write_all(stream, data: bytes) -> None:
+    """Write `data` to `stream`, ignoring errors from a crashed decoder."""
+    try:
+        stream.write(data)
+        stream.flush()
+    except (BrokenPipeError, ValueError):
+        # The reader notices the crash when the decoder's stdout hits EOF
+        pass
+
+
+class StreamDecoder:
+    """
+    Decodes batches of base64 encoded envelopes with a single stellar-xdr
+    process, restarting it if it exits. An envelope that makes the decoder exit
+    is passed to `decode_one` instead, which is expected to raise if the
+    envelope is invalid.
+    """
+    def __init__(self, decode_one: Callable[[str], dict[str, Any]],
+                 cmd: list[str] = STREAM_DECODE_CMD):
+        self._decode_one = decode_one
+        self._cmd = cmd
+        self._proc = None
+
+    def _process(self) -> subprocess.Popen:
+        if self._proc is None:
+            self._proc = subprocess.Popen(self._cmd, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE)
+        return self._proc
+
+    def close(self) -> None:
+        """Stop the decoder process, if it is running."""
+        if self._proc is None:
+            return
+        for stream in (self._proc.stdin, self._proc.stdout):
+            try:
+                stream.close()
+            except BrokenPipeError:
+                pass
+        self._proc.wait()
+        self._proc = None
+
+    def decode(self, envelopes: list[str]) -> list[dict[str, Any]]:
+        """
+        Decode a batch of base64 encoded envelopes, returning the decoded JSON
+        for each in order. Envelopes are written from a separate thread, so
+        the decoder can apply back-pressure through its stdin pipe without
+        deadlocking against its full stdout pipe.
+        """
+        raw = [b64decode(envelope, validate=True) for envelope in envelopes]
+        decoded = []
+        while len(decoded) < len(raw):
+            proc = self._process()
+            remaining = raw[len(decoded):]
+            writer = threading.Thread(target=_write_all,
+                                      args=(proc.stdin, b"".join(remaining)))
+            writer.start()
+            for _ in remaining:
+                line = proc.stdout.readline()
+                if not line:
+                    break
+                decoded.append(json.loads(line))
+            writer.join()
+
+            if len(decoded) < len(raw):
+                # The decoder exited before decoding everything. Restart it
+                # after retrying the envelope it stopped on by itself.
+                self.close()
+                decoded.append(self._decode_one(envelopes[len(decoded)]))
+        return decoded
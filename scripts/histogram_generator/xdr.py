@@ -0,0 +1,165 @@
+# Copyright 2024 Stellar Development Foundation and contributors. Licensed
+# under the Apache License, Version 2.0. See the COPYING file at the root
+# of this distribution or at http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+In-process decoding of the parts of a TransactionEnvelope that
+HistogramGenerator.py reads. Only the prefix of the envelope up to the first
+operation's host function is parsed, so decoding is a handful of
+`struct.unpack_from` calls rather than a `stellar-xdr` subprocess per row.
+"""
+
+from collections import namedtuple
+import struct
+from typing import Any
+
+# Summary of a TransactionEnvelope. `wasm_size` is the size of the uploaded
+# wasm if the first operation is a wasm upload, and None otherwise.
+EnvelopeSummary = namedtuple("EnvelopeSummary",
+                             ["is_tx", "num_operations", "is_invoke",
+                              "wasm_size"])
+
+# Summary of any envelope that is not an ENVELOPE_TYPE_TX envelope, such as a
+# fee bump
+NOT_A_TRANSACTION = EnvelopeSummary(False, 0, False, None)
+
+# XDR enum values, from Stellar-ledger-entries.x, Stellar-transaction.x and
+# Stellar-types.x
+ENVELOPE_TYPE_TX = 2
+KEY_TYPE_ED25519 = 0
+KEY_TYPE_MUXED_ED25519 = 0x100
+PRECOND_NONE = 0
+PRECOND_TIME = 1
+PRECOND_V2 = 2
+SIGNER_KEY_TYPE_ED25519_SIGNED_PAYLOAD = 3
+MEMO_NONE = 0
+MEMO_TEXT = 1
+MEMO_ID = 2
+MEMO_HASH = 3
+MEMO_RETURN = 4
+INVOKE_HOST_FUNCTION = 24
+HOST_FUNCTION_TYPE_UPLOAD_CONTRACT_WASM = 2
+
+_UINT32 = struct.Struct(">I")
+
+
+class XdrError(Exception):
+    """An envelope could not be decoded"""
+
+
+class _Reader:
+    """Sequential reader over an XDR buffer"""
+    __slots__ = ("_buf", "_pos")
+
+    def __init__(self, buf: bytes):
+        self._buf = buf
+        self._pos = 0
+
+    def uint32(self) -> int:
+        if self._pos + 4 > len(self._buf):
+            raise XdrError("unexpected end of envelope")
+        (val,) = _UINT32.unpack_from(self._buf, self._pos)
+        self._pos += 4
+        return val
+
+    def skip(self, size: int) -> None:
+        if self._pos + size > len(self._buf):
+            raise XdrError("unexpected end of envelope")
+        self._pos += size
+
+    def skip_opaque(self) -> int:
+        """Skip a variable length opaque or string. Returns its length."""
+        size = self.uint32()
+        self.skip((size + 3) & ~3)
+        return size
+
+    def skip_muxed_account(self) -> None:
+        key_type = self.uint32()
+        if key_type == KEY_TYPE_ED25519:
+            self.skip(32)
+        elif key_type == KEY_TYPE_MUXED_ED25519:
+            self.skip(40)
+        else:
+            raise XdrError(f"invalid CryptoKeyType {key_type}")
+
+    def skip_preconditions(self) -> None:
+        cond_type = self.uint32()
+        if cond_type == PRECOND_NONE:
+            return
+        if cond_type == PRECOND_TIME:
+            self.skip(16)
+            return
+        if cond_type != PRECOND_V2:
+            raise XdrError(f"invalid PreconditionType {cond_type}")
+        if self.uint32():
+            self.skip(16)  # timeBounds
+        if self.uint32():
+            self.skip(8)  # ledgerBounds
+        if self.uint32():
+            self.skip(8)  # minSeqNum
+        self.skip(12)  # minSeqAge and minSeqLedgerGap
+        for _ in range(self.uint32()):
+            signer_type = self.uint32()
+            self.skip(32)
+            if signer_type == SIGNER_KEY_TYPE_ED25519_SIGNED_PAYLOAD:
+                self.skip_opaque()
+
+    def skip_memo(self) -> None:
+        memo_type = self.uint32()
+        if memo_type == MEMO_NONE:
+            return
+        if memo_type == MEMO_TEXT:
+            self.skip_opaque()
+        elif memo_type == MEMO_ID:
+            self.skip(8)
+        elif memo_type in (MEMO_HASH, MEMO_RETURN):
+            self.skip(32)
+        else:
+            raise XdrError(f"invalid MemoType {memo_type}")
+
+
+def summarize_envelope(envelope: bytes) -> EnvelopeSummary:
+    """Summarize a raw (not base64 encoded) TransactionEnvelope."""
+    reader = _Reader(envelope)
+    if reader.uint32() != ENVELOPE_TYPE_TX:
+        return NOT_A_TRANSACTION
+
+    # Transaction fields preceding the operations
+    reader.skip_muxed_account()
+    reader.skip(12)  # fee and seqNum
+    reader.skip_preconditions()
+    reader.skip_memo()
+
+    num_operations = reader.uint32()
+    if num_operations == 0:
+        return EnvelopeSummary(True, 0, False, None)
+
+    # First operation
+    if reader.uint32():
+        reader.skip_muxed_account()
+    if reader.uint32() != INVOKE_HOST_FUNCTION:
+        return EnvelopeSummary(True, num_operations, False, None)
+    if reader.uint32() != HOST_FUNCTION_TYPE_UPLOAD_CONTRACT_WASM:
+        return EnvelopeSummary(True, num_operations, True, None)
+    return EnvelopeSummary(True, num_operations, True, reader.skip_opaque())
+
+
+def summarize_json(envelope: dict[str, Any]) -> EnvelopeSummary:
+    """
+    Summarize a TransactionEnvelope decoded to JSON by `stellar-xdr`. Produces
+    the same result as `summarize_envelope` on the same envelope.
+    """
+    if "tx" not in envelope:
+        return NOT_A_TRANSACTION
+    operations = envelope["tx"]["tx"]["operations"]
+    if not operations:
+        return EnvelopeSummary(True, 0, False, None)
+    body = operations[0]["body"]
+    if "invoke_host_function" not in body:
+        return EnvelopeSummary(True, len(operations), False, None)
+    host_function = body["invoke_host_function"]["host_function"]
+    if "upload_contract_wasm" not in host_function:
+        return EnvelopeSummary(True, len(operations), True, None)
+    wasm = host_function["upload_contract_wasm"]
+    return EnvelopeSummary(True, len(operations), True,
+                           len(bytes.fromhex(wasm)))
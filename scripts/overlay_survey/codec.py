@@ -0,0 +1,195 @@
+"""
+This module provides the JSON codec used for survey results and GraphML
+attribute payloads. It uses msgspec or orjson when either is installed and falls
+back to the standard library `json` module otherwise. Running this module
+directly benchmarks the available backends on a synthetic survey payload.
+
+Backends are imported on first use rather than at import time, since importing
+msgspec is slow compared to the rest of OverlaySurvey.py's startup.
+"""
+
+from collections import namedtuple
+import functools
+import json
+import logging
+from typing import Any, Optional, TypedDict
+
+logger = logging.getLogger(__name__)
+
+
+class PeerStats(TypedDict, total=False):
+    """A single entry in a node's `inboundPeers` or `outboundPeers` list"""
+    nodeId: str
+    version: str
+    averageLatencyMs: int
+    bytesRead: int
+    bytesWritten: int
+    duplicateFetchBytesRecv: int
+    duplicateFetchMessageRecv: int
+    duplicateFloodBytesRecv: int
+    duplicateFloodMessageRecv: int
+    messagesRead: int
+    messagesWritten: int
+    secondsConnected: int
+    uniqueFetchBytesRecv: int
+    uniqueFetchMessageRecv: int
+    uniqueFloodBytesRecv: int
+    uniqueFloodMessageRecv: int
+
+
+class NodeSurvey(TypedDict, total=False):
+    """A node's entry in the `topology` field of a survey result"""
+    inboundPeers: Optional[list[PeerStats]]
+    outboundPeers: Optional[list[PeerStats]]
+    numTotalInboundPeers: int
+    numTotalOutboundPeers: int
+    maxInboundPeerCount: int
+    maxOutboundPeerCount: int
+    addedAuthenticatedPeers: int
+    droppedAuthenticatedPeers: int
+    p75SCPFirstToSelfLatencyMs: int
+    p75SCPSelfToOtherLatencyMs: int
+    lostSyncCount: int
+    isValidator: bool
+
+
+class SurveyResult(TypedDict, total=False):
+    """The body returned by stellar-core's getsurveyresult endpoint"""
+    # stellar-core clears `backlog` rather than setting it to an empty list,
+    # which leaves it null once the backlog drains
+    backlog: Optional[list[str]]
+    badResponseNodes: Optional[list[str]]
+    surveyInProgress: bool
+    topology: dict[str, Optional[NodeSurvey]]
+
+
+# Exceptions raised when decoding invalid JSON. orjson's error is a subclass of
+# `json.JSONDecodeError`, and msgspec's is a subclass of `ValueError`.
+DecodeError = (ValueError, TypeError)
+
+# A JSON implementation. `decode_survey_result` decodes a getsurveyresult body,
+# and only checks it against `SurveyResult` for msgspec.
+Backend = namedtuple("Backend",
+                     ["name", "loads", "dumps", "decode_survey_result"])
+
+
+@functools.lru_cache(maxsize=None)
+def available_backends():
+    """
+    Import the installed JSON backends. Returns a dict from backend name to
+    `Backend`, ordered from most to least preferred for untyped decoding.
+    """
+    backends = {}
+    try:
+        import orjson
+        backends["orjson"] = Backend("orjson", orjson.loads, orjson.dumps,
+                                     orjson.loads)
+    except ImportError:
+        pass
+    try:
+        import msgspec
+        decoder = msgspec.json.Decoder()
+
+        def decode_survey_result(data):
+            # Decoding straight into SurveyResult would drop fields it does not
+            # declare, so validate the untyped result instead. This costs less
+            # than decoding twice. A result that does not match is still
+            # returned, as stellar-core may change the schema under a
+            # survey that has been running for hours.
+            result = decoder.decode(data)
+            try:
+                msgspec.convert(result, SurveyResult)
+            except msgspec.ValidationError as e:
+                logger.warning("Unexpected survey result schema: %s", e)
+            return result
+
+        backends["msgspec"] = Backend(
+            "msgspec", decoder.decode, msgspec.json.Encoder().encode,
+            decode_survey_result)
+    except ImportError:
+        pass
+    backends["json"] = Backend("json", json.loads,
+                               lambda obj: json.dumps(obj).encode("utf-8"),
+                               json.loads)
+    return backends
+
+
+def backend():
+    """Return the `Backend` used by `loads` and `dumps`."""
+    return next(iter(available_backends().values()))
+
+
+def loads(data) -> Any:
+    """Decode a JSON document from `str` or `bytes`."""
+    return backend().loads(data)
+
+
+def dumps(obj) -> bytes:
+    """Encode `obj` to UTF-8 encoded JSON."""
+    return backend().dumps(obj)
+
+
+def dump(obj, path):
+    """Encode `obj` to JSON and write it to the file at `path`."""
+    with open(path, 'wb') as outfile:
+        outfile.write(dumps(obj))
+
+
+def decode_survey_result(data) -> SurveyResult:
+    """
+    Decode a getsurveyresult body. With msgspec installed the result is
+    checked against `SurveyResult`, and a warning is logged if it does not
+    match. Fields not declared in the types above are kept, so every backend
+    returns the same result.
+    """
+    backends = available_backends()
+    return backends.get("msgspec", backend()).decode_survey_result(data)
+
+
+def _synthetic_survey_result(num_nodes, peers_per_node):
+    """Build a survey result shaped like stellar-core's getsurveyresult body"""
+    peer = {field: 12345 for field in PeerStats.__annotations__}
+    peer["version"] = "v22.0.0-12-gabcdef01"
+    topology = {}
+    for i in range(num_nodes):
+        node = {field: 42 for field in NodeSurvey.__annotations__}
+        node["isValidator"] = bool(i % 2)
+        node["inboundPeers"] = [dict(peer, nodeId=f"G{i:055d}{j}")
+                                for j in range(peers_per_node)]
+        node["outboundPeers"] = node["inboundPeers"][:8]
+        topology[f"G{i:056d}"] = node
+    return {"backlog": [], "badResponseNodes": None,
+            "surveyInProgress": True, "topology": topology}
+
+
+def benchmark(num_nodes=2000, peers_per_node=25, repeat=5):
+    """Print parse and dump throughput for each available backend."""
+    import time
+
+    payload = json.dumps(_synthetic_survey_result(num_nodes, peers_per_node))
+    data = payload.encode("utf-8")
+    megabytes = len(data) / (1 << 20)
+    print(f"Payload size: {megabytes:.1f} MiB")
+
+    runs = []
+    for b in reversed(available_backends().values()):
+        runs.append((b.name, b.loads, b.dumps))
+        if b.decode_survey_result is not b.loads:
+            runs.append((f"{b.name} (validated)", b.decode_survey_result,
+                         b.dumps))
+
+    for name, decode, encode in runs:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            obj = decode(data)
+        parse = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(repeat):
+            encode(obj)
+        dump_time = time.perf_counter() - start
+        print(f"{name:>19s}: parse {megabytes * repeat / parse:8.1f} MiB/s, "
+              f"dump {megabytes * repeat / dump_time:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    benchmark()
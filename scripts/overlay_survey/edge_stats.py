@@ -0,0 +1,157 @@
+"""
+This module computes flood efficiency statistics from the per-edge metrics
+recorded in an overlay survey graph. All aggregation is done over numpy columns
+so that it stays fast on graphs with hundreds of thousands of edges.
+
+An edge's metrics are those one of its endpoints reported about the
+connection, so bytes received on an edge were received by that endpoint, and
+each edge counts once towards per-node, per-version and per-organization
+totals.
+"""
+
+import numpy as np
+
+# Edge attributes loaded into columns. Edges missing an attribute (for example,
+# graphs produced by older surveys) are treated as having a value of 0.
+EDGE_COLUMNS = ["duplicateFloodBytesRecv",
+                "uniqueFloodBytesRecv",
+                "duplicateFetchBytesRecv",
+                "bytesRead",
+                "bytesWritten"]
+
+# Edge attribute naming the node that reported the edge's metrics. Graphs
+# recorded before it was added lack it.
+REPORTER_ATTR = "reportedBy"
+
+# Node attributes used to group nodes. `sb_organizationId` is only present on
+# graphs augmented with StellarBeat data.
+VERSION_ATTR = "version"
+ORG_ATTR = "sb_organizationId"
+
+# Group label for nodes missing the grouping attribute
+UNKNOWN_GROUP = "unknown"
+
+
+class EdgeColumns:
+    """
+    Columnar view of the edges of a survey graph. `src`, `dst` and `reporter`
+    hold indices into `nodes`, with a `reporter` of -1 for edges that do not
+    name theirs, and `columns` maps each name in EDGE_COLUMNS to a float64
+    array with one entry per edge.
+    """
+    def __init__(self, graph):
+        self.nodes = list(graph.nodes)
+        index = {node: i for i, node in enumerate(self.nodes)}
+        edges = list(graph.edges(data=True))
+        self.src = np.fromiter((index[u] for (u, _, _) in edges), np.int64,
+                               count=len(edges))
+        self.dst = np.fromiter((index[v] for (_, v, _) in edges), np.int64,
+                               count=len(edges))
+        self.reporter = np.fromiter(
+            (index.get(d.get(REPORTER_ATTR), -1) for (_, _, d) in edges),
+            np.int64, count=len(edges))
+        self.columns = {c: np.fromiter((d.get(c, 0) for (_, _, d) in edges),
+                                       np.float64, count=len(edges))
+                        for c in EDGE_COLUMNS}
+        self.node_attrs = {VERSION_ATTR: self._node_labels(graph, VERSION_ATTR),
+                           ORG_ATTR: self._node_labels(graph, ORG_ATTR)}
+
+    def _node_labels(self, graph, attr):
+        """Return a string array holding `attr` for every node."""
+        return np.array([str(graph.nodes[n].get(attr, UNKNOWN_GROUP))
+                         for n in self.nodes])
+
+    def wasted_bytes(self):
+        """Bytes received on each edge that were duplicates."""
+        return (self.columns["duplicateFloodBytesRecv"] +
+                self.columns["duplicateFetchBytesRecv"])
+
+    def node_sums(self, column):
+        """
+        Sum `column` over the edges each node reported, so each edge counts
+        once. An edge with no known reporter counts half towards each of its
+        endpoints.
+        """
+        num_nodes = len(self.nodes)
+        values = self.columns[column]
+        known = self.reporter >= 0
+        halves = np.where(known, 0.0, values / 2)
+        return (np.bincount(self.reporter[known], weights=values[known],
+                            minlength=num_nodes) +
+                np.bincount(self.src, weights=halves, minlength=num_nodes) +
+                np.bincount(self.dst, weights=halves, minlength=num_nodes))
+
+
+def _ratio(numerator, denominator):
+    """Elementwise ratio, with NaN wherever `denominator` is 0."""
+    out = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=out, where=denominator > 0)
+    return out
+
+
+def _to_json_number(value):
+    """Convert a numpy scalar to a JSON-safe Python value."""
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def _summarize(labels, dup, uniq, fetch):
+    """Build a list of per-label flood stats sorted by duplicate ratio."""
+    ratio = _ratio(dup, uniq)
+    # Sort by ratio descending, with undefined ratios last
+    order = np.argsort(-np.nan_to_num(ratio, nan=-np.inf), kind="stable")
+    return [{"name": str(labels[i]),
+             "duplicateFloodBytesRecv": _to_json_number(dup[i]),
+             "uniqueFloodBytesRecv": _to_json_number(uniq[i]),
+             "duplicateFetchBytesRecv": _to_json_number(fetch[i]),
+             "duplicateToUniqueFloodRatio": _to_json_number(ratio[i])}
+            for i in order]
+
+
+def _group_sums(labels, per_node):
+    """Sum each array in `per_node` over nodes sharing a label."""
+    groups, inverse = np.unique(labels, return_inverse=True)
+    return groups, [np.bincount(inverse, weights=v, minlength=len(groups))
+                    for v in per_node]
+
+
+def flood_stats(graph, top):
+    """
+    Compute duplicate/unique flood ratios per node, per version, and per
+    organization, along with the `top` edges receiving the most duplicate
+    bytes and the number of edges whose reporter is unknown. Returns a
+    JSON-serializable dict.
+    """
+    edges = EdgeColumns(graph)
+    per_node = [edges.node_sums("duplicateFloodBytesRecv"),
+                edges.node_sums("uniqueFloodBytesRecv"),
+                edges.node_sums("duplicateFetchBytesRecv")]
+    nodes = np.array(edges.nodes)
+
+    stats = {"edgesWithoutReporter": int(np.count_nonzero(edges.reporter < 0)),
+             "nodes": _summarize(nodes, *per_node)}
+    for key, attr in [("versions", VERSION_ATTR), ("organizations", ORG_ATTR)]:
+        groups, sums = _group_sums(edges.node_attrs[attr], per_node)
+        stats[key] = _summarize(groups, *sums)
+
+    wasted = edges.wasted_bytes()
+    top = min(top, len(wasted))
+    if top > 0:
+        # Select the top edges in linear time, then sort just those
+        candidates = np.argpartition(-wasted, top - 1)[:top]
+        ranked = candidates[np.argsort(-wasted[candidates], kind="stable")]
+    else:
+        ranked = np.empty(0, dtype=np.int64)
+    wasted_fraction = _ratio(wasted, edges.columns["bytesRead"])
+    stats["wastefulEdges"] = [
+        {"source": edges.nodes[edges.src[i]],
+         "target": edges.nodes[edges.dst[i]],
+         "reportedBy": (edges.nodes[edges.reporter[i]]
+                        if edges.reporter[i] >= 0 else None),
+         "wastedBytes": _to_json_number(wasted[i]),
+         "wastedFractionOfBytesRead": _to_json_number(wasted_fraction[i]),
+         **{c: _to_json_number(edges.columns[c][i]) for c in EDGE_COLUMNS}}
+        for i in ranked]
+    return stats
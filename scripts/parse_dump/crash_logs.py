@@ -0,0 +1,118 @@
+"""
+This module finds the raw backtraces stellar-core prints when it crashes in a
+set of log files, and groups them into crash buckets, so ParseDump.py can
+symbolize each distinct frame once however many traces there are.
+
+A backtrace is a run of consecutive lines holding a frame as printed by
+backtrace_symbols, such as "./src/stellar-core(+0xd9f6bd) [0x55ab4c2456bd]",
+possibly after a prefix added by whatever collected the log. Traces are
+bucketed by the offsets of their top stellar-core frames. Frames of the crash
+handler itself are the same in every trace, so enough frames must be compared
+to reach past them.
+
+A trace is dated by the last timestamp, in ISO 8601 form, seen in its file
+before it, or by the modification time of the file if there is none. Its host
+is named after the file: for a file found in a directory given on the command
+line, the first component of its path below that directory (as with logs laid
+out as <dir>/<host>/...), and otherwise the file's own path.
+"""
+
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+import gzip
+import os
+import re
+
+# Default number of top stellar-core frames compared to bucket traces
+DEFAULT_FRAMES = 10
+
+# A frame printed by backtrace_symbols: module(symbol+offset) [address]
+FRAME = re.compile(r"(\S+)\(([^()]*)\) \[0x[0-9a-f]+\]")
+
+TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}")
+
+# A backtrace found in a log: where and when it was seen, and the module and
+# offset (or symbol and offset) of each of its frames, top first
+Trace = namedtuple("Trace", ["path", "host", "seen", "frames"])
+
+# Traces whose top frames match, in the order they were found, with the first
+# and last times they were seen and the number of them seen on each host
+Bucket = namedtuple("Bucket", ["key", "traces", "first_seen", "last_seen", "hosts"])
+
+
+def log_files(paths):
+    """
+    The log files among `paths` and in directories among them, as (path,
+    host) pairs.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file = os.path.join(root, name)
+                relative = os.path.relpath(file, path)
+                yield file, relative.split(os.sep)[0]
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, errors="replace")
+
+
+def read_traces(path, host):
+    """ Yield every backtrace in the log file `path`. """
+    mtime = os.path.getmtime(path)
+    seen = datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    frames = []
+    with _open(path) as f:
+        for line in f:
+            found = FRAME.search(line)
+            if found:
+                module, location = found.groups()
+                frames.append((os.path.basename(module), location))
+                continue
+            if frames:
+                yield Trace(path, host, seen, frames)
+                frames = []
+            found = TIMESTAMP.search(line)
+            if found:
+                seen = found.group(0).replace(" ", "T")
+    if frames:
+        yield Trace(path, host, seen, frames)
+
+
+def core_offsets(trace):
+    """ The offsets of the stellar-core frames of `trace`, top first. """
+    return [
+        location[1:]
+        for module, location in trace.frames
+        if "stellar-core" in module and location.startswith("+")
+    ]
+
+
+def bucket_traces(traces, frames=DEFAULT_FRAMES):
+    """
+    Group traces by the offsets of their top `frames` stellar-core frames, or
+    by their top `frames` frames if they have no stellar-core frames. Returns
+    buckets with the most traces first.
+    """
+    groups = dict()
+    for trace in traces:
+        key = tuple(core_offsets(trace)[:frames]) or tuple(trace.frames[:frames])
+        groups.setdefault(key, []).append(trace)
+    buckets = [
+        Bucket(
+            key,
+            traces,
+            min(trace.seen for trace in traces),
+            max(trace.seen for trace in traces),
+            Counter(trace.host for trace in traces),
+        )
+        for key, traces in groups.items()
+    ]
+    # sorted is stable, so ties keep their order of first appearance
+    return sorted(buckets, key=lambda bucket: -len(bucket.traces))
@@ -0,0 +1,523 @@
+"""
+This module keeps an on-disk index of the function ranges and line table of a
+stellar-core executable, so ParseDump.py can symbolize offsets by binary search
+rather than by having addr2line parse the debug info again for every trace.
+
+The index is built once per build, from the output of `nm` and `readelf`, and
+cached in a file named after the executable's build ID. It answers only for
+offsets outside inlined code: addr2line names the innermost inlined function
+at an offset, which the symbol table does not know, so offsets inside inlined
+code are left to addr2line. The address ranges of inlined code are read from
+the DWARF debug info, with range lists read from the executable directly, as
+readelf does not print them all. Inlined code whose ranges cannot be read
+excludes its whole enclosing function from the index.
+
+Locations addr2line gives for the offsets the index cannot tell are also
+cached, next to the index, so symbolizing the same frames again never runs
+addr2line.
+
+Function names are those of the symbol table, without the suffixes of clones
+such as " [clone .isra.0]", as addr2line mostly prints them. The line table
+printed by readelf has no discriminators, so locations from the index omit the
+" (discriminator N)" suffix addr2line may add.
+"""
+
+from array import array
+import bisect
+import json
+import os
+import re
+import struct
+import subprocess
+import zlib
+
+# Bump when the index format changes, to rebuild old indexes
+INDEX_VERSION = 1
+
+# Default directory for cached indexes
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "stellar-core",
+    "symbols",
+)
+
+# Arrays stored in an index file after its JSON header, in order, with their
+# typecodes. Functions and lines are sorted by start address, and the inlined
+# code ranges are disjoint.
+ARRAYS = [
+    ("function_starts", "Q"),
+    ("function_ends", "Q"),
+    ("function_names", "L"),
+    ("line_addresses", "Q"),
+    ("line_files", "L"),
+    ("line_numbers", "L"),
+    ("inlined_starts", "Q"),
+    ("inlined_ends", "Q"),
+]
+
+# nm symbol types of code
+CODE_SYMBOL_TYPES = set("TtWw")
+
+# Suffixes of the symbols of clones of functions made by the compiler, such as
+# their cold parts, which addr2line names after the function they came from
+CLONE_SUFFIX = re.compile(r"(?: \[clone \.[\w.]+\]|\.cold)+$")
+
+# Line number readelf prints for the end of a sequence of rows
+END_OF_SEQUENCE = "-"
+
+# ELF section flag and header of compressed sections
+SHF_COMPRESSED = 0x800
+ELFCOMPRESS_ZLIB = 1
+COMPRESSION_HEADER_SIZE = 24
+
+# DWARF 5 range list entry kinds read from .debug_rnglists, and the size of
+# its table header
+DW_RLE_END_OF_LIST = 0
+DW_RLE_OFFSET_PAIR = 4
+DW_RLE_BASE_ADDRESS = 5
+DW_RLE_START_END = 6
+DW_RLE_START_LENGTH = 7
+RNGLISTS_HEADER_SIZE = 12
+
+# DWARF 4 .debug_ranges entry that sets the base address
+BASE_ADDRESS_SELECTION = (1 << 64) - 1
+
+
+def build_id(exe):
+    """ The GNU build ID of `exe` in hex, or None if it has none. """
+    output = subprocess.run(
+        ["readelf", "-n", exe], stdout=subprocess.PIPE, text=True, check=True
+    ).stdout
+    found = re.search(r"Build ID: ([0-9a-f]+)", output)
+    return found.group(1) if found else None
+
+
+def _read_functions(exe):
+    """ Sorted (start, end, name) of every code symbol with a size. """
+    output = subprocess.Popen(
+        ["nm", "-C", "-S", "--defined-only", exe],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    functions = []
+    for line in output.stdout:
+        # address size type name, where the demangled name may contain spaces
+        fields = line.rstrip("\n").split(" ", 3)
+        if len(fields) == 4 and fields[2] in CODE_SYMBOL_TYPES:
+            start = int(fields[0], 16)
+            size = int(fields[1], 16)
+            if size > 0:
+                name = CLONE_SUFFIX.sub("", fields[3])
+                functions.append((start, start + size, name))
+    if output.wait() != 0:
+        raise subprocess.CalledProcessError(output.returncode, output.args)
+    functions.sort()
+    return functions
+
+
+def _read_lines(exe):
+    """
+    The decoded line table, as a list of file names and arrays of the
+    address, file index and line of each row, sorted by address. Ends of
+    sequences have line 0, which no row has. Of several rows at one address
+    in a sequence only the last is kept, as addr2line does, and rows of a
+    sequence starting at the end of another replace its end.
+    """
+    output = subprocess.Popen(
+        ["readelf", "-W", "--debug-dump=decodedline", exe],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    file_index = dict()
+    addresses, files, numbers = array("Q"), array("L"), array("L")
+    # Whether the last row kept is from the current sequence
+    in_sequence = False
+    for line in output.stdout:
+        fields = line.split()
+        # file line address [view] [stmt]
+        if len(fields) < 3 or not fields[2].startswith("0x"):
+            continue
+        try:
+            address = int(fields[2], 16)
+            number = 0 if fields[1] == END_OF_SEQUENCE else int(fields[1])
+        except ValueError:
+            continue
+        file = file_index.setdefault(os.path.basename(fields[0]), len(file_index))
+        if addresses and addresses[-1] == address and (in_sequence or number):
+            files[-1], numbers[-1] = file, number
+        elif in_sequence or number:
+            addresses.append(address)
+            files.append(file)
+            numbers.append(number)
+        in_sequence = number != 0
+    if output.wait() != 0:
+        raise subprocess.CalledProcessError(output.returncode, output.args)
+
+    # Sequences are mostly in address order already
+    if any(addresses[i] > addresses[i + 1] for i in range(len(addresses) - 1)):
+        order = sorted(range(len(addresses)), key=addresses.__getitem__)
+        addresses = array("Q", (addresses[i] for i in order))
+        files = array("L", (files[i] for i in order))
+        numbers = array("L", (numbers[i] for i in order))
+        # Where sequences overlap, the last row at an address beats ends of
+        # sequences there
+        keep = []
+        i = 0
+        while i < len(addresses):
+            chosen = j = i
+            while j < len(addresses) and addresses[j] == addresses[i]:
+                if numbers[j] or not numbers[chosen]:
+                    chosen = j
+                j += 1
+            keep.append(chosen)
+            i = j
+        addresses = array("Q", (addresses[i] for i in keep))
+        files = array("L", (files[i] for i in keep))
+        numbers = array("L", (numbers[i] for i in keep))
+    return list(file_index), addresses, files, numbers
+
+
+def _read_section(exe, name):
+    """
+    The contents of the section `name` of the 64-bit little-endian ELF file
+    `exe`, or None if it has no such section or it is compressed other than
+    with zlib.
+    """
+    # Only the headers and the sections needed are read, as executables with
+    # debug info can be very large
+    with open(exe, "rb") as f:
+
+        def read(offset, size):
+            f.seek(offset)
+            return f.read(size)
+
+        ident = read(0, 0x40)
+        if ident[:4] != b"\x7fELF" or ident[4] != 2 or ident[5] != 1:
+            return None
+        shoff, = struct.unpack_from("<Q", ident, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from("<HHH", ident, 0x3A)
+        headers = read(shoff, shnum * shentsize)
+
+        def header(i):
+            # sh_name, sh_flags, sh_offset and sh_size
+            fields = struct.unpack_from("<IIQQQQ", headers, i * shentsize)
+            return fields[0], fields[2], fields[4], fields[5]
+
+        _, _, strings_offset, strings_size = header(shstrndx)
+        strings = read(strings_offset, strings_size)
+        for i in range(shnum):
+            name_offset, flags, offset, size = header(i)
+            end = strings.index(b"\0", name_offset)
+            if strings[name_offset:end].decode() != name:
+                continue
+            section = read(offset, size)
+            if flags & SHF_COMPRESSED:
+                compression, = struct.unpack_from("<I", section)
+                if compression != ELFCOMPRESS_ZLIB:
+                    return None
+                section = zlib.decompress(section[COMPRESSION_HEADER_SIZE:])
+            return section
+    return None
+
+
+def _uleb128(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, offset
+
+
+def _range_list(rnglists, offset, base):
+    """
+    The (start, end) pairs of the DWARF 5 range list at `offset` in
+    `rnglists`, with `base` the base address of its compilation unit, or None
+    if the list refers to .debug_addr, which is not read.
+    """
+    ranges = []
+    while True:
+        kind = rnglists[offset]
+        offset += 1
+        if kind == DW_RLE_END_OF_LIST:
+            return ranges
+        if kind == DW_RLE_OFFSET_PAIR:
+            start, offset = _uleb128(rnglists, offset)
+            end, offset = _uleb128(rnglists, offset)
+            ranges.append((base + start, base + end))
+        elif kind == DW_RLE_BASE_ADDRESS:
+            base, = struct.unpack_from("<Q", rnglists, offset)
+            offset += 8
+        elif kind == DW_RLE_START_END:
+            ranges.append(struct.unpack_from("<QQ", rnglists, offset))
+            offset += 16
+        elif kind == DW_RLE_START_LENGTH:
+            start, = struct.unpack_from("<Q", rnglists, offset)
+            length, offset = _uleb128(rnglists, offset + 8)
+            ranges.append((start, start + length))
+        else:
+            return None
+
+
+def _ranges(debug_ranges, offset, base):
+    """
+    The (start, end) pairs of the DWARF 4 range list at `offset` in
+    `debug_ranges`, with `base` the base address of its compilation unit.
+    """
+    ranges = []
+    while True:
+        start, end = struct.unpack_from("<QQ", debug_ranges, offset)
+        offset += 16
+        if start == end == 0:
+            return ranges
+        if start == BASE_ADDRESS_SELECTION:
+            base = end
+        else:
+            ranges.append((base + start, base + end))
+
+
+def _read_inlined_code(exe):
+    """
+    Address ranges of inlined code, as arrays of their starts and ends, and
+    addresses within inlined code whose ranges could not be read.
+    """
+    output = subprocess.Popen(
+        ["readelf", "-W", "--debug-dump=info", exe],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    rnglists = _read_section(exe, ".debug_rnglists")
+    debug_ranges = _read_section(exe, ".debug_ranges")
+    unit_version = re.compile(r"^\s+Version:\s+(\d+)")
+    entry = re.compile(r"^ <(\d+)><[0-9a-f]+>: Abbrev Number: \d+(?: \((\w+)\))?")
+    # readelf -W prints the form of each attribute, and zero without "0x"
+    attribute = re.compile(
+        r"^\s+<[0-9a-f]+>\s+(DW_AT_\w+)\s*: \((\w+)\) (0x[0-9a-f]+|0)\b"
+    )
+    starts, ends = array("Q"), array("Q")
+    scattered = []
+    # Lowest known address of the innermost entry at each depth
+    known_address = dict()
+    version, unit = 0, dict()
+    depth, tag, attributes, forms = 0, None, dict(), dict()
+
+    def read_ranges():
+        value = attributes["DW_AT_ranges"]
+        base = unit.get("DW_AT_low_pc", 0)
+        if version < 5:
+            return None if debug_ranges is None else _ranges(debug_ranges, value, base)
+        if rnglists is None:
+            return None
+        if forms["DW_AT_ranges"] == "rnglistx":
+            # An index into the offsets following the unit's rnglists_base
+            lists_base = unit.get("DW_AT_rnglists_base", RNGLISTS_HEADER_SIZE)
+            value = lists_base + struct.unpack_from(
+                "<I", rnglists, lists_base + 4 * value
+            )[0]
+        return _range_list(rnglists, value, base)
+
+    def finish():
+        if depth == 0:
+            unit.clear()
+            unit.update(attributes)
+        low = attributes.get("DW_AT_low_pc")
+        address = low
+        if address is None:
+            address = attributes.get("DW_AT_entry_pc")
+        if address is None:
+            address = next(
+                (known_address[d] for d in range(depth - 1, -1, -1)
+                 if known_address.get(d) is not None),
+                None,
+            )
+        known_address[depth] = address
+        if tag != "DW_TAG_inlined_subroutine":
+            return
+        high = attributes.get("DW_AT_high_pc")
+        if low is not None and high is not None:
+            # Unless it is an address, the high PC is a length
+            if forms["DW_AT_high_pc"] != "addr":
+                high += low
+            starts.append(low)
+            ends.append(high)
+            return
+        inlined = read_ranges() if "DW_AT_ranges" in attributes else None
+        if inlined is not None:
+            for start, end in inlined:
+                starts.append(start)
+                ends.append(end)
+        elif address is not None:
+            scattered.append(address)
+
+    for line in output.stdout:
+        found = entry.match(line)
+        if found:
+            if tag is not None:
+                finish()
+            depth, tag = int(found.group(1)), found.group(2)
+            attributes, forms = dict(), dict()
+            continue
+        found = attribute.match(line)
+        if found and tag is not None:
+            forms[found.group(1)] = found.group(2)
+            attributes[found.group(1)] = int(found.group(3), 16)
+            continue
+        found = unit_version.match(line)
+        if found:
+            version = int(found.group(1))
+    if tag is not None:
+        finish()
+    if output.wait() != 0:
+        raise subprocess.CalledProcessError(output.returncode, output.args)
+    return starts, ends, scattered
+
+
+def _merge(starts, ends):
+    """ Merge ranges into sorted disjoint ones. """
+    merged_starts, merged_ends = array("Q"), array("Q")
+    for i in sorted(range(len(starts)), key=starts.__getitem__):
+        if merged_ends and starts[i] <= merged_ends[-1]:
+            merged_ends[-1] = max(merged_ends[-1], ends[i])
+        else:
+            merged_starts.append(starts[i])
+            merged_ends.append(ends[i])
+    return merged_starts, merged_ends
+
+
+class SymbolIndex:
+    """ Function ranges and line table of one build of stellar-core. """
+
+    def __init__(self, names, files, arrays):
+        self.names = names
+        self.files = files
+        for name, _ in ARRAYS:
+            setattr(self, name, arrays[name])
+        # Locations addr2line gave for offsets the index cannot tell, and the
+        # file they are kept in
+        self.resolved = {}
+        self.resolved_path = None
+
+    @classmethod
+    def build(cls, exe):
+        """ Index `exe` from the output of `nm` and `readelf`. """
+        functions = _read_functions(exe)
+        files, line_addresses, line_files, line_numbers = _read_lines(exe)
+        inlined_starts, inlined_ends, scattered = _read_inlined_code(exe)
+
+        starts = [start for start, _, _ in functions]
+        for address in scattered:
+            i = bisect.bisect_right(starts, address) - 1
+            if i >= 0 and address < functions[i][1]:
+                inlined_starts.append(functions[i][0])
+                inlined_ends.append(functions[i][1])
+        inlined_starts, inlined_ends = _merge(inlined_starts, inlined_ends)
+
+        names = sorted({name for _, _, name in functions})
+        name_index = {name: i for i, name in enumerate(names)}
+        arrays = {
+            "function_starts": array("Q", starts),
+            "function_ends": array("Q", [end for _, end, _ in functions]),
+            "function_names": array(
+                "L", [name_index[name] for _, _, name in functions]
+            ),
+            "line_addresses": line_addresses,
+            "line_files": line_files,
+            "line_numbers": line_numbers,
+            "inlined_starts": inlined_starts,
+            "inlined_ends": inlined_ends,
+        }
+        return cls(names, files, arrays)
+
+    @classmethod
+    def load(cls, path):
+        """ Load the index at `path`, or None if it is missing or outdated. """
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                if header["version"] != INDEX_VERSION:
+                    return None
+                arrays = dict()
+                for name, typecode in ARRAYS:
+                    arrays[name] = array(typecode)
+                    arrays[name].fromfile(f, header["lengths"][name])
+        except (OSError, ValueError, KeyError, EOFError):
+            return None
+        return cls(header["names"], header["files"], arrays)
+
+    def save(self, path):
+        """ Write the index to `path`, replacing it atomically. """
+        header = {
+            "version": INDEX_VERSION,
+            "names": self.names,
+            "files": self.files,
+            "lengths": {name: len(getattr(self, name)) for name, _ in ARRAYS},
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for name, _ in ARRAYS:
+                getattr(self, name).tofile(f)
+        os.replace(tmp_path, path)
+
+    def lookup(self, offset):
+        """
+        The location of `offset` as addr2line prints it with -f -C -p -s, or
+        None if the index cannot tell, because the offset is inside inlined
+        code or has no known function or line, and it was not remembered.
+        """
+        if offset in self.resolved:
+            return self.resolved[offset]
+        address = int(offset, 16)
+        i = bisect.bisect_right(self.inlined_starts, address) - 1
+        if i >= 0 and address < self.inlined_ends[i]:
+            return None
+        i = bisect.bisect_right(self.function_starts, address) - 1
+        if i < 0 or address >= self.function_ends[i]:
+            return None
+        j = bisect.bisect_right(self.line_addresses, address) - 1
+        if j < 0 or self.line_numbers[j] == 0:
+            return None
+        return "{} at {}:{}".format(
+            self.names[self.function_names[i]],
+            self.files[self.line_files[j]],
+            self.line_numbers[j],
+        )
+
+    def remember(self, locations):
+        """
+        Remember the locations addr2line gave for offsets `lookup` could not
+        tell, and save them next to the index, replacing the file atomically.
+        """
+        if not locations:
+            return
+        self.resolved.update(locations)
+        if self.resolved_path is not None:
+            tmp_path = "{}.tmp".format(self.resolved_path)
+            with open(tmp_path, "w") as f:
+                json.dump(self.resolved, f)
+            os.replace(tmp_path, self.resolved_path)
+
+
+def load_or_build(exe, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    The index of `exe`, loaded from `cache_dir` or built and saved there.
+    Returns None if `exe` has no build ID to key the index by.
+    """
+    key = build_id(exe)
+    if key is None:
+        return None
+    path = os.path.join(cache_dir, "{}.idx".format(key))
+    index = SymbolIndex.load(path)
+    if index is None:
+        index = SymbolIndex.build(exe)
+        index.save(path)
+    index.resolved_path = os.path.join(cache_dir, "{}.resolved.json".format(key))
+    try:
+        with open(index.resolved_path) as f:
+            index.resolved = json.load(f)
+    except (OSError, ValueError):
+        pass
+    return index
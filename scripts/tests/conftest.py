@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import their helper packages from the directory they are in
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
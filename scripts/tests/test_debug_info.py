@@ -0,0 +1,98 @@
+import contextlib
+import importlib.machinery
+import importlib.util
+import pathlib
+import sqlite3
+import threading
+
+import pytest
+
+SCRIPT = pathlib.Path(__file__).parent.parent / "stellar-core-debug-info"
+
+
+def load_script():
+    # The script has no .py extension, so it needs an explicit loader
+    loader = importlib.machinery.SourceFileLoader("stellar_core_debug_info",
+                                                  str(SCRIPT))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+debug_info = load_script()
+
+
+def create_database(path, journal_mode):
+    with contextlib.closing(sqlite3.connect(path)) as db:
+        db.execute(f"PRAGMA journal_mode={journal_mode}")
+        db.execute("CREATE TABLE t(id INTEGER PRIMARY KEY, v INTEGER)")
+        db.execute("CREATE TABLE total(s INTEGER, c INTEGER)")
+        db.execute("CREATE TABLE filler(b BLOB)")
+        db.execute("INSERT INTO total VALUES (0, 0)")
+        db.executemany("INSERT INTO filler VALUES (randomblob(10000))",
+                       [()] * 200)
+        db.commit()
+
+
+class Writer(threading.Thread):
+    """
+    Commits transactions that each insert into `t` and update `total` to
+    match, so a snapshot is consistent only if it contains whole transactions.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.stop = threading.Event()
+        self.committed = 0
+
+    def run(self):
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as db:
+            while not self.stop.is_set():
+                with db:
+                    db.execute("INSERT INTO t(v) VALUES (?)",
+                               (self.committed,))
+                    db.execute("UPDATE total SET s = s + ?, c = c + 1",
+                               (self.committed,))
+                self.committed += 1
+                self.stop.wait(0.001)
+
+
+@pytest.mark.parametrize("journal_mode", ["wal", "delete"])
+def test_snapshot_is_consistent_during_writes(tmp_path, monkeypatch,
+                                              journal_mode):
+    # Copy the database in many small steps, so that writes land between them
+    monkeypatch.setattr(debug_info, "SQLITE_BACKUP_PAGES", 16)
+    monkeypatch.setattr(debug_info, "SQLITE_BACKUP_PAUSE", 0.005)
+    path = tmp_path / "stellar.db"
+    snapshot_path = tmp_path / "snapshot.db"
+    create_database(path, journal_mode)
+
+    writer = Writer(path)
+    writer.start()
+    try:
+        while writer.committed < 10:
+            writer.stop.wait(0.01)
+        committed_before = writer.committed
+        stalls = debug_info.snapshot_sqlite(path, snapshot_path)
+        committed_after = writer.committed
+    finally:
+        writer.stop.set()
+        writer.join()
+    assert committed_after > committed_before
+    if journal_mode == "wal":
+        assert stalls == 0
+
+    with contextlib.closing(sqlite3.connect(snapshot_path)) as snapshot:
+        rows, values = snapshot.execute(
+            "SELECT count(*), sum(v) FROM t").fetchone()
+        assert snapshot.execute("SELECT c, s FROM total").fetchone() == (
+            rows, values)
+        assert rows >= committed_before
+        assert snapshot.execute("PRAGMA integrity_check").fetchall() == [
+            ("ok",)]
+        assert snapshot.execute("PRAGMA journal_mode").fetchone() == (
+            "delete",)
+    assert sorted(p.name for p in tmp_path.glob("snapshot.db*")) == [
+        "snapshot.db"]
@@ -0,0 +1,112 @@
+import csv
+
+import numpy as np
+import pytest
+
+import DiffTracyCSV
+from diff_tracy_csv.sketch import KllSketch
+
+
+def write_export(path, zones, scale):
+    """ Write a Tracy CSV export with `zones[line]` events of each zone. """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(DiffTracyCSV.COLUMNS)
+        start = 0
+        for line, events in enumerate(zones, 1):
+            for i in range(events):
+                start += 1000
+                writer.writerow(["zone{}".format(line), "src/a.cpp", line,
+                                 start, (100 + 10 * line + i) * scale])
+    return str(path)
+
+
+def rolled_up_changes(tmp_path, runs):
+    old = [write_export(tmp_path / "old{}.csv".format(i), [2, 2, 2, 2], 1)
+           for i in range(runs)]
+    new = [write_export(tmp_path / "new{}.csv".format(i), [2, 2, 2, 2], 3)
+           for i in range(runs)]
+    old, new = (
+        [DiffTracyCSV.rollup(run, DiffTracyCSV.ROLLUPS["file"])
+         for run in DiffTracyCSV.read_files(files, use_sidecar=False)]
+        for files in (old, new))
+    return DiffTracyCSV.filter_zone_changes(old, new, 10, 1, 1, 1,
+                                            resamples=100)
+
+
+def test_rollup_of_short_zones(tmp_path, capsys):
+    # Each zone has too few events for quantiles, but their group does not
+    changes = rolled_up_changes(tmp_path, 1)
+    assert [c.key for c in changes] == ["src/a.cpp"]
+    measures = changes[0].measures
+    assert measures.median.old is None and not measures.median.flag
+    assert measures.p90.old is None and not measures.p90.flag
+    assert measures.sum.flag
+    assert measures.events.old == measures.events.new == 8
+    DiffTracyCSV.print_changes(changes, "99% CI of diff")
+    assert "|   median |               - |" in capsys.readouterr().out
+
+
+def test_rollup_of_short_zones_across_runs(tmp_path, capsys):
+    changes = rolled_up_changes(tmp_path, 2)
+    assert [c.key for c in changes] == ["src/a.cpp"]
+    measures = changes[0].measures
+    assert measures.median.ci is None and not measures.median.flag
+    assert measures.sum.ci is not None and measures.sum.flag
+    DiffTracyCSV.print_changes(changes, "99% CI of diff")
+    capsys.readouterr()
+
+
+def test_zone_intervals_without_distributions():
+    runs = [DiffTracyCSV.ZoneStats(2, 300.0, None, None, None, None, None)]
+    intervals = DiffTracyCSV.zone_intervals(runs, runs, 100, 0.99,
+                                            np.random.default_rng(0))
+    assert intervals["median"] is None and intervals["p90"] is None
+    assert intervals["sum"] == (0.0, 0.0)
+
+
+def test_small_exports_are_parsed_without_workers(tmp_path, monkeypatch):
+    files = [write_export(tmp_path / "{}.csv".format(i), [5, 3], i + 1)
+             for i in range(2)]
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("started a pool for small exports")
+    monkeypatch.setattr(DiffTracyCSV, "Pool", no_pool)
+    runs = DiffTracyCSV.read_files(files, use_sidecar=False, workers=4)
+    assert [run[("zone1", "src/a.cpp", "1")].events for run in runs] == [5, 5]
+
+
+def test_parallel_parsing_matches(tmp_path, monkeypatch):
+    files = [write_export(tmp_path / "{}.csv".format(i), [5, 3, 1], i + 1)
+             for i in range(3)]
+    serial = DiffTracyCSV.read_files(files, use_sidecar=False, workers=1)
+    monkeypatch.setattr(DiffTracyCSV, "PARALLEL_PARSE_SIZE", 0)
+    parallel = DiffTracyCSV.read_files(files, use_sidecar=False, workers=2)
+    assert [{key: stats[:5] for key, stats in run.items()}
+            for run in parallel] == [
+                {key: stats[:5] for key, stats in run.items()}
+                for run in serial]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("k", [32, 128])
+def test_sketch_quantiles_within_rank_error(seed, k):
+    # Compare the ranks of sketch quantiles with exact ranks on lognormal data
+    # fed in chunks, as zone times are
+    n = 50_000
+    delta = 0.01
+    rng = np.random.default_rng(seed)
+    data = rng.lognormal(10, 1.5, n)
+    sketch = KllSketch(k, rng)
+    for chunk in np.array_split(data, 37):
+        sketch.update(chunk)
+    assert not sketch.is_exact()
+    assert sketch.size() < 3 * k + 2 * len(sketch.levels)
+    data.sort()
+    bound = sketch.rank_error(delta)
+    for q in (0.5, 0.9, 0.99):
+        estimate = sketch.quantile(q)
+        # Fraction of values below and up to the estimate
+        low = np.searchsorted(data, estimate, side="left") / n
+        high = np.searchsorted(data, estimate, side="right") / n
+        assert max(low - q, q - high, 0.0) <= bound
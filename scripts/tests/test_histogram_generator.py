@@ -0,0 +1,100 @@
+from contextlib import redirect_stdout
+import io
+
+import numpy as np
+import pytest
+
+import HistogramGenerator
+from HistogramGenerator import MAX_BINS, MAX_OUTPUT_BINS
+
+
+def reference_histogram(data, weights=None, value_range=None):
+    """
+    The implementation `to_normalized_histogram` replaced, which calls
+    `np.histogram` once per candidate number of bins.
+    """
+    for i in range(MAX_BINS, MAX_OUTPUT_BINS-1, -1):
+        hist, bins = np.histogram(data, bins=i, range=value_range,
+                                  weights=weights)
+        total = np.sum(hist)
+        normalized = (hist / total) * 1000
+        normalized = normalized.round().astype(int)
+        if len([x for x in normalized if x != 0]) <= MAX_OUTPUT_BINS:
+            break
+
+    midpoints = np.empty(len(bins) - 1)
+    for i in range(len(bins) - 1):
+        midpoints[i] = (bins[i] + bins[i + 1]) / 2
+    midpoints = midpoints.round().astype(int)
+
+    print("[ ", end="")
+    for count, point in zip(normalized, midpoints):
+        if count == 0:
+            continue
+        print(f"({point}, {count}); ", end="")
+    print("]")
+
+
+def printed(func, *args, **kwargs):
+    out = io.StringIO()
+    with redirect_stdout(out):
+        func(*args, **kwargs)
+    return out.getvalue()
+
+
+def assert_same_output(data, weights=None, value_range=None):
+    expected = printed(reference_histogram, data, weights, value_range)
+    actual = printed(HistogramGenerator.to_normalized_histogram, data,
+                     weights, value_range)
+    assert actual == expected
+
+
+def random_data(rng, size):
+    dtype = rng.choice(["int64", "float64", "float32"])
+    shape = rng.choice(["uniform", "lognormal", "duplicates"])
+    if shape == "uniform":
+        data = rng.uniform(-1000, rng.uniform(-999, 10 ** 6), size)
+    elif shape == "lognormal":
+        data = rng.lognormal(8, 2, size)
+    else:
+        data = rng.choice(rng.uniform(0, 10 ** 4, 5), size)
+    return data.astype(dtype)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    data = random_data(rng, int(rng.integers(1, 2000)))
+    weights = None
+    if seed % 3 == 0:
+        weights = rng.integers(0, 50, len(data))
+    value_range = None
+    if seed % 4 == 0:
+        low, high = np.sort(rng.choice(data, 2))
+        value_range = (int(low), int(high) + 1)
+    assert_same_output(data, weights, value_range)
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_matches_reference_on_bin_edges(seed):
+    # Values equal to bin edges of candidate bin counts, including the last
+    # edge, which the last bin includes
+    rng = np.random.default_rng(seed)
+    dtype = rng.choice(["int64", "float64", "float32"])
+    bins = int(rng.integers(MAX_OUTPUT_BINS, MAX_BINS + 1))
+    low = int(rng.integers(-1000, 1000))
+    high = low + bins * int(rng.integers(1, 100))
+    edges = np.histogram_bin_edges(np.array([low, high], dtype=dtype),
+                                   bins=bins)
+    data = np.concatenate([rng.choice(edges, int(rng.integers(1, 500))),
+                           rng.uniform(low, high, int(rng.integers(0, 500)))
+                           ]).astype(dtype)
+    weights = rng.integers(1, 10, len(data)) if seed % 2 else None
+    assert_same_output(data, weights)
+    assert_same_output(data, weights, (low, high))
+
+
+def test_matches_reference_on_constant_data():
+    assert_same_output(np.full(1000, 7))
+    assert_same_output(np.full(10, 2.5))
+    assert_same_output(np.array([42]), np.array([3]))
@@ -0,0 +1,58 @@
+from base64 import b64decode
+import json
+import pathlib
+import struct
+
+import pytest
+
+import HistogramGenerator
+from histogram_generator import xdr
+
+# Envelopes built with the Python stellar-sdk, each with the JSON the
+# stellar-xdr tool decodes it to and its expected summary
+CORPUS = json.loads((pathlib.Path(__file__).parent / "data" /
+                     "xdr_envelopes.json").read_text())
+
+
+def expected_summary(case):
+    return xdr.EnvelopeSummary(**case["summary"])
+
+
+@pytest.mark.parametrize("case", CORPUS,
+                         ids=[case["description"] for case in CORPUS])
+def test_summarize_envelope(case):
+    envelope = b64decode(case["envelope"])
+    assert xdr.summarize_envelope(envelope) == expected_summary(case)
+
+
+@pytest.mark.parametrize("case", CORPUS,
+                         ids=[case["description"] for case in CORPUS])
+def test_summarize_json(case):
+    summary = xdr.summarize_json(case["stellar_xdr_json"])
+    assert summary == expected_summary(case)
+
+
+def test_summarize_envelopes():
+    envelopes = [case["envelope"] for case in CORPUS]
+    assert HistogramGenerator.summarize_envelopes(envelopes) == [
+        expected_summary(case) for case in CORPUS]
+
+
+def test_unknown_memo_type_raises():
+    [case] = [case for case in CORPUS
+              if case["description"] == "v1 envelope without a memo"]
+    envelope = bytearray(b64decode(case["envelope"]))
+    # The memo follows the envelope type, the ed25519 source account, fee,
+    # seqNum and time bounds preconditions
+    memo_offset = 4 + 36 + 12 + 20
+    assert envelope[memo_offset:memo_offset + 4] == struct.pack(
+        ">I", xdr.MEMO_NONE)
+    envelope[memo_offset:memo_offset + 4] = struct.pack(">I", 5)
+    with pytest.raises(xdr.XdrError, match="MemoType 5"):
+        xdr.summarize_envelope(bytes(envelope))
+
+
+def test_truncated_envelope_raises():
+    envelope = b64decode(CORPUS[1]["envelope"])
+    with pytest.raises(xdr.XdrError):
+        xdr.summarize_envelope(envelope[:60])
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from overlay_survey import codec
+
+
+def survey_result_with_new_fields():
+    result = codec._synthetic_survey_result(3, 2)
+    result["newTopLevelField"] = {"nested": [1, 2]}
+    for node in result["topology"].values():
+        node["newNodeField"] = 7
+        for peer in node["inboundPeers"]:
+            peer["newPeerField"] = "x"
+    return result
+
+
+@pytest.mark.parametrize("name", list(codec.available_backends()))
+def test_backends_keep_undeclared_fields(name):
+    result = survey_result_with_new_fields()
+    data = json.dumps(result).encode("utf-8")
+    backend = codec.available_backends()[name]
+    assert backend.decode_survey_result(data) == result
+    assert backend.loads(data) == result
+    assert json.loads(backend.dumps(result)) == result
+
+
+@pytest.mark.parametrize("name", list(codec.available_backends()))
+def test_backends_accept_null_backlog(name):
+    # stellar-core leaves the backlog null once it has drained
+    result = codec._synthetic_survey_result(3, 2)
+    result["backlog"] = None
+    data = json.dumps(result).encode("utf-8")
+    backend = codec.available_backends()[name]
+    assert backend.decode_survey_result(data) == result
+
+
+def test_msgspec_warns_on_unexpected_schema(caplog):
+    if "msgspec" not in codec.available_backends():
+        pytest.skip("msgspec is not installed")
+    result = survey_result_with_new_fields()
+    result["surveyInProgress"] = "yes"
+    assert codec.decode_survey_result(json.dumps(result)) == result
+    [record] = caplog.records
+    assert record.levelname == "WARNING"
+    assert "surveyInProgress" in record.getMessage()
+
+
+def test_invalid_json_raises_decode_error():
+    with pytest.raises(codec.DecodeError):
+        codec.decode_survey_result(b'{"topology": ')
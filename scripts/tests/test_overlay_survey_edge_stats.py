@@ -0,0 +1,67 @@
+import networkx as nx
+
+import OverlaySurvey
+from overlay_survey import edge_stats
+
+
+def by_name(entries):
+    return {entry["name"]: entry for entry in entries}
+
+
+def one_edge_graph(**edge_attrs):
+    graph = nx.DiGraph()
+    graph.add_node("A", version="v1", sb_organizationId="org")
+    graph.add_node("B", version="v1", sb_organizationId="org")
+    graph.add_edge("A", "B", duplicateFloodBytesRecv=100,
+                   uniqueFloodBytesRecv=400, duplicateFetchBytesRecv=10,
+                   bytesRead=1000, bytesWritten=2000, **edge_attrs)
+    return graph
+
+
+def test_edge_counts_once_towards_its_reporter():
+    stats = edge_stats.flood_stats(one_edge_graph(reportedBy="B"), 20)
+    nodes = by_name(stats["nodes"])
+    assert nodes["B"]["duplicateFloodBytesRecv"] == 100
+    assert nodes["B"]["uniqueFloodBytesRecv"] == 400
+    assert nodes["B"]["duplicateFetchBytesRecv"] == 10
+    assert nodes["B"]["duplicateToUniqueFloodRatio"] == 0.25
+    assert nodes["A"]["duplicateFloodBytesRecv"] == 0
+    assert nodes["A"]["duplicateToUniqueFloodRatio"] is None
+    for key in ["versions", "organizations"]:
+        [group] = stats[key]
+        assert group["duplicateFloodBytesRecv"] == 100
+        assert group["uniqueFloodBytesRecv"] == 400
+        assert group["duplicateFetchBytesRecv"] == 10
+    assert stats["edgesWithoutReporter"] == 0
+    [edge] = stats["wastefulEdges"]
+    assert (edge["source"], edge["target"], edge["reportedBy"]) == ("A", "B",
+                                                                   "B")
+    assert edge["wastedBytes"] == 110
+
+
+def test_edge_without_reporter_counts_half_towards_each_endpoint():
+    stats = edge_stats.flood_stats(one_edge_graph(), 20)
+    nodes = by_name(stats["nodes"])
+    assert nodes["A"]["duplicateFloodBytesRecv"] == 50
+    assert nodes["B"]["duplicateFloodBytesRecv"] == 50
+    [version] = stats["versions"]
+    assert version["duplicateFloodBytesRecv"] == 100
+    assert stats["edgesWithoutReporter"] == 1
+    assert stats["wastefulEdges"][0]["reportedBy"] is None
+
+
+def test_survey_records_reporter(tmp_path):
+    peer = {"nodeId": "B", "version": "v1", "duplicateFloodBytesRecv": 100,
+            "uniqueFloodBytesRecv": 400}
+    graph = nx.DiGraph()
+    results = {"inboundPeers": {}, "outboundPeers": {}}
+    OverlaySurvey.update_results(graph, {"inboundPeers": [peer]}, "A",
+                                 results, True)
+    # Survey graphs are saved and analyzed as GraphML
+    path = tmp_path / "survey.graphml"
+    nx.write_graphml(graph, path)
+    graph = nx.read_graphml(path)
+    assert graph.edges["B", "A"]["reportedBy"] == "A"
+    nodes = by_name(edge_stats.flood_stats(graph, 20)["nodes"])
+    assert nodes["A"]["duplicateFloodBytesRecv"] == 100
+    assert nodes["B"]["duplicateFloodBytesRecv"] == 0
@@ -0,0 +1,43 @@
+import json
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+SCRIPTS = pathlib.Path(__file__).parent.parent
+
+# Modules that only the subcommands using them should import
+HEAVY_MODULES = ["networkx", "numpy", "requests", "overlay_survey.simulation"]
+
+PRINT_MODULES = "import json, sys; print(json.dumps(sorted(sys.modules)))"
+
+
+def loaded_modules(code):
+    """Run `code` in a fresh interpreter and return the modules it loaded."""
+    out = subprocess.run([sys.executable, "-c", f"{code}\n{PRINT_MODULES}"],
+                         cwd=SCRIPTS, check=True, capture_output=True,
+                         text=True).stdout
+    return set(json.loads(out.splitlines()[-1]))
+
+
+def assert_no_heavy_modules(modules):
+    assert [m for m in HEAVY_MODULES if m in modules] == []
+
+
+def test_import_does_not_load_heavy_modules():
+    assert_no_heavy_modules(loaded_modules("import OverlaySurvey"))
+
+
+@pytest.mark.parametrize("argv", [["--help"], ["flatten", "--help"],
+                                  ["simulate", "--help"]])
+def test_help_does_not_load_heavy_modules(argv):
+    code = f"""
+import runpy, sys
+sys.argv = ["OverlaySurvey.py"] + {argv!r}
+try:
+    runpy.run_path("OverlaySurvey.py", run_name="__main__")
+except SystemExit as e:
+    assert e.code == 0, e.code
+"""
+    assert_no_heavy_modules(loaded_modules(code))